@@ -4,7 +4,7 @@ import eventlet
 from gunicorn.app.base import BaseApplication
 from gunicorn.workers.geventlet import EventletWorker
 
-from subworker import SubWorker, DispatchError
+from subworker import SubWorker, DispatchError, response_body
 from config import Config, YamlConfig
 import workers
 
@@ -36,7 +36,7 @@ def wsgi(env, response):
     #     response("500 Internal Server Error", [('Content-Type', 'application/json; utf-8')])
     #     result = e.args[0] or ''
 
-    return [result.encode('utf-8')]
+    return response_body(result)
 
 
 class Application(BaseApplication):
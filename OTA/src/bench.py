@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарки OTA.
+Запуск из OTA/src: python3 bench.py [name ...]
+"""
+
+import io
+import json
+import re
+import sys
+import timeit
+from collections import OrderedDict
+
+from decoder import ZeepDecoder
+from subworker import Router, stream_response
+from workers.ota_worker import LoginForm
+
+BENCHES = {}
+
+
+def bench(func):
+    BENCHES[func.__name__] = func
+    return func
+
+
+def report(name, number, seconds):
+    print(f'{name:<48} {number / seconds:>12.0f} op/s {seconds / number * 1e6:>10.2f} us/op')
+
+
+class _Handler:
+    def GET(self, env, response):
+        pass
+
+    def POST(self, env, response):
+        pass
+
+
+@bench
+def router(sizes=(10, 100, 1000), ops=200000):
+    for size in sizes:
+        number = ops // size
+        handler = _Handler()
+        routes = {}
+        router = Router()
+        for i in range(size):
+            route = f'/v1/static{i}' if i % 2 else rf'/v1/item{i}/(\d+)'
+            routes[route] = handler
+            router.add(route, handler)
+        router.compile()
+
+        paths = [f'/v1/static{size - 1}', f'/v1/item{size - 2}/42', '/v1/missing']
+
+        def legacy():
+            for path in paths:
+                for regex, obj in routes.items():
+                    if re.match(f'^{regex}$', path):
+                        getattr(obj, 'GET', None)
+                        break
+
+        def compiled():
+            for path in paths:
+                table = router.lookup(path)
+                if table is not None:
+                    table.get('GET')
+
+        report(f'router legacy scan   {size:>5} routes', number, timeit.timeit(legacy, number=number))
+        report(f'router compiled      {size:>5} routes', number, timeit.timeit(compiled, number=number))
+
+
+class _Value:
+    """Аналог zeep CompoundValue: __json__ отдаёт OrderedDict полей"""
+
+    def __init__(self, **kwargs):
+        self.__values__ = OrderedDict(kwargs)
+
+    def __json__(self):
+        return self.__values__
+
+
+def _campaigns(count):
+    return _Value(campaigns=[_Value(
+        id=i, name=f'Campaign {i}\r\n', description='x' * 64, isFinished=False, priority=i % 5,
+        target=_Value(type='SIM', filter=_Value(iccid=[f'8970{i:015d}'], msisdn=None)),
+        scripts=[_Value(id=j, name=f'script {j}', payload='00' * 32) for j in range(3)],
+    ) for i in range(count)], total=count)
+
+
+def _rec_copy(obj):
+    if type(obj) is list:
+        return [_rec_copy(i) for i in obj]
+    elif type(obj) is str:
+        return obj.rstrip('\r\n')
+    elif hasattr(obj, '__json__'):
+        return {k: _rec_copy(v) for k, v in obj.__json__().items()}
+    else:
+        return obj
+
+
+@bench
+def decoder(count=5000, number=5):
+    res = _campaigns(count)
+    full = ZeepDecoder()
+    projected = ZeepDecoder({'campaigns': {'id': True, 'name': True, 'isFinished': True}, 'total': True})
+    assert json.dumps(full.decode(res)) == json.dumps(_rec_copy(res))
+    assert ''.join(full.iterencode(res)) == json.dumps(_rec_copy(res))
+
+    report(f'decoder legacy _rec_copy     {count} items', number, timeit.timeit(lambda: _rec_copy(res), number=number))
+    report(f'decoder decode               {count} items', number, timeit.timeit(lambda: full.decode(res), number=number))
+    report(f'decoder decode projected     {count} items', number,
+           timeit.timeit(lambda: projected.decode(res), number=number))
+    report(f'decoder legacy + json.dumps  {count} items', number,
+           timeit.timeit(lambda: json.dumps(_rec_copy(res)), number=number))
+    report(f'decoder dump to buffer       {count} items', number,
+           timeit.timeit(lambda: full.dump(res, io.StringIO()), number=number))
+    report(f'decoder iterencode           {count} items', number,
+           timeit.timeit(lambda: ''.join(full.iterencode(res)), number=number))
+    report(f'decoder iterencode projected {count} items', number,
+           timeit.timeit(lambda: ''.join(projected.iterencode(res)), number=number))
+
+
+# страница логина OTA: форма со скрытыми полями внутри типовой разметки
+LOGIN_PAGE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>OTA Server</title>'
+    + '<link rel="stylesheet" href="/ota/static/css/app.css?v=1.0.10">' * 20
+    + '<script src="/ota/static/js/vendor.js"></script></head><body><div class="login">'
+    + '<div class="row"><span class="label">OTA Server 1.0.10 build 2467</span></div>' * 50
+    + '<form id="loginForm" name="loginForm" method="post" action="/ota/j_spring_security_check">'
+    '<input type="hidden" name="buildversion" value="1.0.10 build 2467"/>'
+    '<input type="hidden" name="_csrf" value="3f2c1e7a-9b1d-4c55-8e0a-6d7f1b2a9c44"/>'
+    '<input type="text" name="j_username" value="" class="field"/>'
+    '<input type="password" name="j_password" value="" class="field"/>'
+    '<input type="submit" name="submit" value="Login" class="button"/>'
+    '</form></div></body></html>').encode('utf-8')
+
+
+def _legacy_login_body(result, username, password):
+    form = re.findall(r'\<(form|input) +(.*?) */?\>', result.decode('utf-8'))
+    form = [(i[0], dict(re.findall(r' ?(\w+)="([^"]*?)"', i[1]))) for i in form]
+    body = []
+    for _, p in form[1:]:
+        if p['type'] == 'hidden':
+            body.append(p['name'] + '=' + p['value'])
+        elif p['type'] == 'text':
+            body.append(p['name'] + '=' + username)
+        elif p['type'] == 'password':
+            body.append(p['name'] + '=' + password)
+    else:
+        body = '&'.join(body)
+    return form[0][1]['method'], form[0][1]['action'], body
+
+
+@bench
+def login(number=20000):
+    def memoized():
+        form = LoginForm.get(LOGIN_PAGE)
+        return form.method, form.action, form.body('user', 'secret')
+
+    def memoized_etag():
+        form = LoginForm.get(LOGIN_PAGE, 'W/"2467"')
+        return form.method, form.action, form.body('user', 'secret')
+
+    assert memoized() == memoized_etag() == _legacy_login_body(LOGIN_PAGE, 'user', 'secret')
+    report(f'login legacy parse        {len(LOGIN_PAGE)} bytes', number,
+           timeit.timeit(lambda: _legacy_login_body(LOGIN_PAGE, 'user', 'secret'), number=number))
+    report(f'login memoized (sha1)     {len(LOGIN_PAGE)} bytes', number, timeit.timeit(memoized, number=number))
+    report(f'login memoized (ETag)     {len(LOGIN_PAGE)} bytes', number, timeit.timeit(memoized_etag, number=number))
+
+
+@bench
+def stream(count=5000, number=5):
+    res = ZeepDecoder().decode(_campaigns(count))['campaigns']
+    expected = json.dumps({'status': 1, 'response': res}).encode('utf-8')
+    assert b''.join(stream_response(res)) == expected
+
+    def iterencode():
+        return b''.join(i.encode('utf-8') for i in json.JSONEncoder().iterencode({'status': 1, 'response': res}))
+
+    report(f'stream json.dumps + encode   {count} items', number,
+           timeit.timeit(lambda: json.dumps({'status': 1, 'response': res}).encode('utf-8'), number=number))
+    report(f'stream JSONEncoder iterencode {count} items', number, timeit.timeit(iterencode, number=number))
+    report(f'stream_response batched      {count} items', number,
+           timeit.timeit(lambda: b''.join(stream_response(res)), number=number))
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHES:
+        BENCHES[name]()
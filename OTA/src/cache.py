@@ -1,36 +1,272 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import datetime
+import hashlib
+import json
 import logging
-from functools import lru_cache
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
 
-@lru_cache(maxsize=128)
 class InMemoryCache:
-    """Simple in-memory caching using dict lookup with(out) support for timeouts"""
+    """
+    In-memory LRU cache shared by all instances, with per-entry timeouts and a byte-size budget.
+    The budget belongs to the shared cache, so it is set once per process with configure(), not per instance.
+    Critical sections never yield, so a plain lock is safe under eventlet workers as well.
+    """
 
-    _cache = {}  # global cache, thread-safe by default
+    _cache = OrderedDict()  # global cache: url -> (expires, size, content), LRU order
+    _lock = threading.Lock()
+    _size = 0
+    max_size = 64 * 1024 * 1024
+    stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
 
     def __init__(self, timeout=3600):
         self._timeout = timeout
 
+    @classmethod
+    def configure(cls, max_size):
+        """Set the byte budget of the shared cache, evicting least recently used entries above it"""
+        with cls._lock:
+            cls.max_size = max_size
+            cls._shrink()
+
+    @classmethod
+    def _shrink(cls):
+        while cls._size > cls.max_size:
+            cls._remove(next(iter(cls._cache)))
+            cls.stats['evictions'] += 1
+
     def add(self, url, content):
-        if url in self._cache: return
-        logger.debug("Caching contents of %s", url)
         if not isinstance(content, (str, bytes)):
             raise TypeError("a bytes-like object is required, not {}".format(type(content).__name__))
-        self._cache[url] = (datetime.datetime.utcnow(), content)
+        size = len(content)
+        if size > self.max_size:
+            logger.debug("Not caching %s: %d bytes exceeds cache size", url, size)
+            return
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None and entry[0] > now: return
+            logger.debug("Caching contents of %s", url)
+            if entry is not None:
+                self._remove(url)
+            self._cache[url] = (now + self._timeout if self._timeout else float('inf'), size, content)
+            InMemoryCache._size += size
+            self._shrink()
 
     def get(self, url):
+        with self._lock:
+            try:
+                expires, _, content = self._cache[url]
+            except KeyError:
+                pass
+            else:
+                if expires > time.monotonic():
+                    self._cache.move_to_end(url)
+                    self.stats['hits'] += 1
+                    logger.debug("Cache HIT for %s", url)
+                    return content
+                self._remove(url)
+                self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+        logger.debug("Cache MISS for %s", url)
+        return None
+
+    @staticmethod
+    def _remove(url):
+        _, size, _ = InMemoryCache._cache.pop(url)
+        InMemoryCache._size -= size
+
+    @classmethod
+    def info(cls):
+        with cls._lock:
+            return {**cls.stats, 'entries': len(cls._cache), 'size': cls._size, 'max_size': cls.max_size}
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._cache.clear()
+            cls._size = 0
+
+
+class DiskCache:
+    """
+    Content-addressed on-disk cache shared by all worker processes and surviving restarts.
+    Documents live in objects/<sha256 of content>; index/<sha1 of url> holds the digest, the last
+    access time, which drives trimming (file atime is unreliable under noatime/relatime), and the
+    ETag/Last-Modified validators for revalidating expired documents (see request.ConditionalTransport).
+    Only the index is kept in process memory. All writes go through a temp file and os.replace,
+    so readers never see partial files.
+    """
+
+    touch_interval = 60  # access time in the index is refreshed at most this often, seconds
+    stale_tmp = 3600  # temp files of crashed writes older than this are removed by trimming, seconds
+
+    def __init__(self, path, timeout=86400, max_size=256 * 1024 * 1024):
+        self._path = os.path.expanduser(path)
+        self._timeout = timeout
+        self.max_size = max_size
+        self._index = {}  # url -> index record
+        os.makedirs(os.path.join(self._path, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(self._path, 'index'), exist_ok=True)
+
+    def _object(self, digest):
+        return os.path.join(self._path, 'objects', digest)
+
+    def _record(self, url):
+        return os.path.join(self._path, 'index', hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _write(self, target, data):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _read(path):
         try:
-            created, content = self._cache[url]
-        except KeyError:
+            with open(path, 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
             pass
-        else:
-            logger.debug("Cache HIT for %s", url)
-            return content
-        logger.debug("Cache MISS for %s", url)
+
+    def _lookup(self, url):
+        record = self._index.get(url)
+        if record is None:
+            record = self._read(self._record(url))
+            if record is None: return None
+            self._index[url] = record
+        return record
+
+    def _records(self):
+        """All index records on disk: [(path, record)]"""
+        records = []
+        with os.scandir(os.path.join(self._path, 'index')) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.tmp'):
+                    record = self._read(entry.path)
+                    if record is not None:
+                        records.append((entry.path, record))
+        return records
+
+    def add(self, url, content, etag=None, last_modified=None):
+        if not isinstance(content, (str, bytes)):
+            raise TypeError("a bytes-like object is required, not {}".format(type(content).__name__))
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        digest = hashlib.sha256(content).hexdigest()
+        now = time.time()
+        record = {'url': url, 'digest': digest, 'size': len(content), 'created': now, 'accessed': now,
+                  'etag': etag, 'last_modified': last_modified}
+        logger.debug("Caching contents of %s on disk", url)
+        previous = self._read(self._record(url))
+        if not os.path.exists(self._object(digest)):
+            self._write(self._object(digest), content)
+        self._write(self._record(url), json.dumps(record).encode('utf-8'))
+        self._index[url] = record
+        if previous is not None and previous['digest'] != digest \
+                and all(r['digest'] != previous['digest'] for _, r in self._records()):
+            self._unlink(self._object(previous['digest']))  # прежняя версия документа больше не нужна
+        self._trim()
+
+    def get(self, url):
+        record = self._lookup(url)
+        if record is not None and self._timeout and record['created'] + self._timeout < time.time():
+            record = None
+        if record is not None:
+            content = self._load(url, record)
+            if content is not None:
+                logger.debug("Disk cache HIT for %s", url)
+                self._touch(url, record)
+                return content
+        logger.debug("Disk cache MISS for %s", url)
         return None
+
+    def _load(self, url, record):
+        try:
+            with open(self._object(record['digest']), 'rb') as f:
+                return f.read()
+        except OSError:  # объект удалён при обрезке кэша другим процессом
+            self._index.pop(url, None)
+            return None
+
+    def validators(self, url):
+        """Headers for a conditional request of a cached, possibly expired document"""
+        record = self._lookup(url)
+        if record is None: return {}
+        headers = {}
+        if record.get('etag'): headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'): headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def revalidate(self, url):
+        """The server confirmed the cached document (304): renew it and return its content, None if it is gone"""
+        record = self._lookup(url)
+        content = self._load(url, record) if record is not None else None
+        if content is not None:
+            now = time.time()
+            record = self._index[url] = {**record, 'created': now, 'accessed': now}
+            self._write(self._record(url), json.dumps(record).encode('utf-8'))
+        return content
+
+    def _touch(self, url, record):
+        now = time.time()
+        if now - record.get('accessed', record['created']) >= self.touch_interval:
+            record = self._index[url] = {**record, 'accessed': now}
+            self._write(self._record(url), json.dumps(record).encode('utf-8'))
+
+    def _trim(self):
+        """
+        Remove stale temp files and objects no index record points to, then drop least recently used
+        entries, index records and objects together, until objects/ fits max_size
+        """
+        now = time.time()
+        objects = {}  # digest -> (size, mtime)
+        for directory in ('objects', 'index'):
+            with os.scandir(os.path.join(self._path, directory)) as it:
+                for entry in it:
+                    if not entry.is_file(): continue
+                    st = entry.stat()
+                    if entry.name.startswith('.tmp'):
+                        if st.st_mtime < now - self.stale_tmp: self._unlink(entry.path)
+                    elif directory == 'objects':
+                        objects[entry.name] = (st.st_size, st.st_mtime)
+        records = self._records()
+        accessed = {}  # digest -> last access through any url
+        for _, record in records:
+            digest = record['digest']
+            accessed[digest] = max(accessed.get(digest, 0), record.get('accessed', record['created']))
+        total = 0
+        for digest, (size, mtime) in list(objects.items()):
+            # объект без записи старше touch_interval - осиротел (запись пишется сразу после объекта)
+            if digest not in accessed and mtime < now - self.touch_interval:
+                self._unlink(self._object(digest))
+                del objects[digest]
+            else:
+                total += size
+        for digest in sorted(accessed, key=accessed.get):
+            if total <= self.max_size: break
+            for path, record in records:
+                if record['digest'] == digest:
+                    self._unlink(path)
+                    self._index.pop(record['url'], None)
+            if digest in objects:
+                self._unlink(self._object(digest))
+                total -= objects[digest][0]
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+
+__all__ = ['ZeepDecoder']
+
+_encode = json.JSONEncoder().encode
+_encode_str = json.encoder.encode_basestring_ascii
+_SCALARS = frozenset((int, float, bool, type(None)))
+
+
+def _leaf(v):
+    """JSON-токен для скаляра, None для вложенных объектов"""
+    t = type(v)
+    if t is str:
+        return _encode_str(v.rstrip('\r\n'))
+    if t is int:
+        return int.__repr__(v)
+    if v is None:
+        return 'null'
+    if t is bool:
+        return 'true' if v else 'false'
+    if t is float:
+        return _encode(v)
+    return None
+
+
+def _copy(obj):
+    """Полная копия рекурсией - самый быстрый путь в CPython для неглубоких ответов"""
+    if type(obj) is list:
+        return [_copy(i) for i in obj]
+    elif type(obj) is str:
+        return obj.rstrip('\r\n')
+    elif hasattr(obj, '__json__'):
+        return {k: _copy(v) for k, v in obj.__json__().items()}
+    else:
+        return obj
+
+
+class ZeepDecoder:
+    """
+    Декодирование zeep-объектов в иерархию list/dict.
+    fields - проекция: {'field': True, 'nested': {'field': True}}; для списков применяется к каждому элементу.
+    None - оставлять все поля: копия рекурсией, а для ответов глубже предела рекурсии - обход со стеком.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = fields
+
+    @staticmethod
+    def _values(node):
+        if type(node) is dict:
+            return node
+        json_ = getattr(node, '__json__', None)
+        return json_() if json_ is not None else None
+
+    @staticmethod
+    def _items(values, spec):
+        if spec is None:
+            return values.items()
+        return [(k, v) for k, v in values.items() if k in spec]
+
+    @staticmethod
+    def _sub(spec, key):
+        if spec is None: return None
+        sub = spec[key]
+        return sub if type(sub) is dict else None
+
+    def decode(self, obj):
+        if self.fields is None:
+            try:
+                return _copy(obj)
+            except RecursionError:
+                pass
+        return self._walk(obj)
+
+    def _walk(self, obj):
+        """Декодирование за один проход без рекурсии, с проекцией"""
+        root = [obj]
+        stack = [(root, 0, self.fields)]  # parent[key] ещё содержит исходный объект
+        push, pop = stack.append, stack.pop
+        while stack:
+            parent, key, spec = pop()
+            node = parent[key]
+            if type(node) is str:
+                parent[key] = node.rstrip('\r\n')
+            elif type(node) is list:
+                out = parent[key] = node[:]
+                for i, v in enumerate(out):
+                    t = type(v)
+                    if t is str:
+                        out[i] = v.rstrip('\r\n')
+                    elif t not in _SCALARS:
+                        push((out, i, spec))
+            else:
+                if type(node) is dict:
+                    values = node
+                else:
+                    json_ = getattr(node, '__json__', None)
+                    if json_ is None: continue
+                    values = json_()
+                if spec is None:
+                    out = parent[key] = dict(values)
+                else:
+                    out = parent[key] = {k: v for k, v in values.items() if k in spec}
+                for k, v in out.items():
+                    t = type(v)
+                    if t is str:
+                        out[k] = v.rstrip('\r\n')
+                    elif t not in _SCALARS:
+                        push((out, k, spec and self._sub(spec, k)))
+        return root[0]
+
+    def iterencode(self, obj, chunk_size=4096):
+        """
+        Куски JSON (как json.dumps(self.decode(obj))) без построения промежуточной иерархии.
+        chunk_size - число токенов в одном куске.
+        """
+        buf = []
+        stack = [(obj, self.fields)]
+        append, push, pop = buf.append, stack.append, stack.pop
+        while stack:
+            item = pop()
+            if type(item) is str:  # готовый токен
+                append(item)
+            elif type(item[0]) is list:
+                node, spec = item
+                if not node:
+                    append('[]')
+                    continue
+                append('[')
+                push(']')
+                for i in range(len(node) - 1, -1, -1):
+                    v = node[i]
+                    token = _leaf(v)
+                    if token is None:
+                        push((v, spec))
+                        if i: push(', ')
+                    else:
+                        push(', ' + token if i else token)
+            else:
+                node, spec = item
+                token = _leaf(node)
+                if token is not None:
+                    append(token)
+                    continue
+                values = self._values(node)
+                if values is None:
+                    append(_encode(node))  # TypeError для несериализуемых, как у json.dumps
+                    continue
+                items = list(self._items(values, spec))
+                if not items:
+                    append('{}')
+                    continue
+                append('{')
+                push('}')
+                for i in range(len(items) - 1, -1, -1):
+                    k, v = items[i]
+                    head = _encode_str(str(k)) + ': '
+                    if i: head = ', ' + head
+                    token = _leaf(v)
+                    if token is None:
+                        push((v, self._sub(spec, k)))
+                        push(head)
+                    else:
+                        push(head + token)
+            if len(buf) >= chunk_size:
+                yield ''.join(buf)
+                buf.clear()
+        if buf:
+            yield ''.join(buf)
+
+    def dump(self, obj, out):
+        """Записать JSON в буфер с методом write(str)"""
+        if self.fields is None:
+            try:
+                out.write(json.dumps(_copy(obj)))
+                return
+            except RecursionError:
+                pass
+        write = out.write
+        for part in self.iterencode(obj):
+            write(part)
@@ -1,19 +1,27 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import hashlib
 import http.client
 import json
 import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import CancelledError
 from functools import partial
 
+import eventlet
 from urllib.parse import urlparse
 from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from zeep import Client
 from zeep.exceptions import *
 from zeep.transports import Transport
 
-from cache import InMemoryCache
+from cache import InMemoryCache, DiskCache
+from decoder import ZeepDecoder
 import sys
 
 logger = logging.getLogger(__name__)
@@ -38,18 +46,162 @@ class Request:
     def _request(self, *args, **kwargs):
         raise NotImplemented
 
+    def spawn(self, item, *args, deadline=None, **kwargs):
+        """
+        Запустить вызов источника в green thread: ota.spawn('get', '/ota/'), ota.spawn('listCampaigns', onlyActive=False)
+        :param deadline: таймаут вызова, секунды
+        """
+        return Future(getattr(self, item), *args, deadline=deadline, **kwargs)
+
+    @staticmethod
+    def gather(*futures, timeout=None, return_exceptions=False):
+        """
+        Дождаться результатов в порядке futures. При первой ошибке (если не return_exceptions) оставшиеся
+        вызовы отменяются. По общему таймауту незавершённые вызовы отменяются всегда: без return_exceptions
+        поднимается TimeoutError, иначе на их местах в результате - TimeoutError.
+        """
+        results = []
+        timer = eventlet.Timeout(timeout)  # без исключения: своё срабатывание отличается от ошибок вызовов
+        try:
+            for f in futures:
+                try:
+                    results.append(f.result())
+                except Exception as e:
+                    if not return_exceptions: raise
+                    results.append(e)
+        except eventlet.Timeout as t:
+            if t is not timer: raise
+            error = TimeoutError('gather timed out')
+            if not return_exceptions:
+                for f in futures:
+                    f.cancel()
+                raise error from None
+            for f in futures[len(results):]:
+                if f.cancel():
+                    results.append(error)
+                    continue
+                try:
+                    results.append(f.result())
+                except Exception as e:
+                    results.append(e)
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+        finally:
+            timer.cancel()
+        return results
+
+
+class Future:
+    """Вызов, выполняемый в eventlet green thread"""
+
+    def __init__(self, func, *args, deadline=None, **kwargs):
+        self.deadline = deadline
+        self.cancelled = False
+        self._thread = eventlet.spawn(self._run, func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        # исключение возвращается, а не пробрасывается: иначе hub eventlet печатает traceback
+        try:
+            with eventlet.Timeout(self.deadline, TimeoutError(f'call timed out after {self.deadline}s')):
+                return False, func(*args, **kwargs)
+        except Exception as e:
+            return True, e
+
+    def done(self):
+        return self._thread.dead
+
+    def cancel(self):
+        if self.done(): return False
+        self.cancelled = True
+        self._thread.kill()
+        return True
+
+    def result(self):
+        if self.cancelled: raise CancelledError()
+        failed, result = self._thread.wait()
+        if failed: raise result
+        return result
+
+
+class ConditionalTransport(Transport):
+    """
+    Transport zeep с условной загрузкой: истёкший в DiskCache документ перепроверяется запросом
+    с If-None-Match/If-Modified-Since, и при 304 продлевается без повторной загрузки.
+    Интерфейс кэша zeep (get/add по url) валидаторов не передаёт, поэтому запрос собирается здесь.
+    """
+
+    def load(self, url):
+        if not isinstance(self.cache, DiskCache) or urlparse(url).scheme not in ('http', 'https'):
+            return super().load(url)
+        content = self.cache.get(url)
+        if content is not None:
+            return content
+        response = self.session.get(url, timeout=self.load_timeout, headers=self.cache.validators(url))
+        if response.status_code == 304:
+            content = self.cache.revalidate(url)
+            if content is not None:
+                logger.debug("Revalidated %s", url)
+                return content
+            response = self.session.get(url, timeout=self.load_timeout)  # объект удалён другим процессом
+        response.raise_for_status()
+        self.cache.add(url, response.content, etag=response.headers.get('ETag'),
+                       last_modified=response.headers.get('Last-Modified'))
+        return response.content
+
 
 class SOAP:
-    def __init__(self, wsdl=None, auth=None, username='', password='', **kwargs):
+    """
+    Клиенты zeep создаются лениво и хранятся на весь процесс по ключу (wsdl, auth, username, хэш пароля):
+    WSDL и XSD разбираются один раз, все сессии используют общий пул соединений.
+    """
+
+    _clients = {}  # (wsdl, auth, username, sha256 пароля) -> zeep.Client
+    _locks = defaultdict(lambda: threading.Lock())  # lambda: брать Lock уже после eventlet.monkey_patch()
+    _adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+
+    def __init__(self, wsdl=None, auth=None, username='', password='', cache_dir=None, fields=None, **kwargs):
         self.wsdl = wsdl
         self.username = username
         self.password = password
         self.auth = auth.lower()
+        self.cache_dir = cache_dir
+        self.decoder = ZeepDecoder(fields)
+        self.key = (self.wsdl, self.auth, self.username, hashlib.sha256(str(password).encode('utf-8')).hexdigest())
+
+    @property
+    def client(self):
+        client = self._clients.get(self.key)
+        if client is None:
+            with self._locks[self.key]:  # WSDL разбирает только один поток, остальные ждут готовый клиент
+                client = self._clients.get(self.key)
+                if client is None:
+                    client = self._clients[self.key] = self._build()
+        return client
 
+    def _build(self):
+        logger.debug("Building SOAP client for %s", self.wsdl)
         session = Session()
+        session.mount('http://', self._adapter)
+        session.mount('https://', self._adapter)
         if self.auth == 'basic':
             session.auth = HTTPBasicAuth(self.username, self.password)
-        self.client = Client(self.wsdl, transport=Transport(cache=InMemoryCache(), session=session))
+        cache = DiskCache(self.cache_dir) if self.cache_dir else InMemoryCache()
+        return Client(self.wsdl, transport=ConditionalTransport(cache=cache, session=session))
+
+    def refresh(self):
+        """Перечитать WSDL для этого клиента"""
+        self._clients.pop(self.key, None)
+        return self.client
+
+    @classmethod
+    def invalidate(cls, wsdl=None, auth=None, username=None):
+        """Сбросить клиентов, подходящих под (wsdl, auth, username) с любым паролем; None - любое значение"""
+        pattern = (wsdl, auth and auth.lower(), username)
+        for key in list(cls._clients):
+            if all(p is None or p == k for p, k in zip(pattern, key)):
+                cls._clients.pop(key, None)
 
     def __getattr__(self, item):
         return partial(self._request, self.client.service[item])
@@ -60,40 +212,151 @@ class SOAP:
             res = req(*args, **kwargs)
         except Error as e:
             raise e
-        return self._rec_copy(res)
-
-    def _rec_copy(self, obj):
-        '''
-        Декодирование zeep-объектов в иерархию list/dict
-        :param obj:
-        :return: list/dict
-        '''
-        if type(obj) is list:
-            return [self._rec_copy(i) for i in obj]
-        elif type(obj) is str:
-            return obj.rstrip('\r\n')
-        elif hasattr(obj, '__json__'):
-            return {k: self._rec_copy(v) for k, v in obj.__json__().items()}
-        else:
-            return obj
+        return self.decoder.decode(res)
+
+
+class ConnectionPool:
+    """
+    Пул keep-alive соединений http.client по хостам.
+    Блокировка и семафоры создаются при первом запросе, то есть уже после eventlet.monkey_patch(),
+    и становятся зелёными, поэтому пул безопасен и для green threads.
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=60, wait=30):
+        self.maxsize = maxsize  # максимум открытых соединений на хост
+        self.idle_timeout = idle_timeout  # через сколько секунд простаивающее соединение закрывается
+        self.wait = wait  # сколько ждать свободного слота
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'retries': 0, 'discards': 0}
+        self._lock = None
+        self._idle = defaultdict(deque)  # host -> deque[(conn, released_at)]
+        self._slots = {}  # host -> BoundedSemaphore(maxsize)
+
+    def configure(self, maxsize=None, idle_timeout=None, wait=None):
+        """Лимиты пула из конфигурации; maxsize действует на хосты, к которым ещё не было запросов"""
+        if maxsize is not None: self.maxsize = maxsize
+        if idle_timeout is not None: self.idle_timeout = idle_timeout
+        if wait is not None: self.wait = wait
+
+    @property
+    def lock(self):
+        if self._lock is None:
+            self._lock = threading.Lock()
+        return self._lock
+
+    def get(self, host, timeout=30):
+        """:return: (conn, reused)"""
+        with self.lock:
+            slots = self._slots.get(host)
+            if slots is None:
+                slots = self._slots[host] = threading.BoundedSemaphore(self.maxsize)
+        if not slots.acquire(timeout=self.wait):
+            raise TimeoutError(f'Connection pool for {host} is exhausted')
+        conn = None
+        with self.lock:
+            idle = self._idle[host]
+            self._evict(idle)
+            if idle:
+                conn, _ = idle.pop()
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+        if conn is None:
+            return http.client.HTTPConnection(host, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None: conn.sock.settimeout(timeout)
+        return conn, True
+
+    def put(self, host, conn):
+        with self.lock:
+            self._idle[host].append((conn, time.monotonic()))
+        self._slots[host].release()
+
+    def discard(self, host, conn):
+        conn.close()
+        with self.lock:
+            self.stats['discards'] += 1
+        self._slots[host].release()
+
+    def retried(self):
+        with self.lock:
+            self.stats['retries'] += 1
+
+    def evict(self):
+        with self.lock:
+            for idle in self._idle.values():
+                self._evict(idle)
+
+    def _evict(self, idle):
+        deadline = time.monotonic() - self.idle_timeout
+        while idle and idle[0][1] < deadline:
+            conn, _ = idle.popleft()
+            conn.close()
+            self.stats['evictions'] += 1
+
+    def close(self):
+        with self.lock:
+            for idle in self._idle.values():
+                while idle:
+                    idle.pop()[0].close()
 
 
 class REST:
-    def __init__(self, host=None, cache=None, username=None, password=None):
+    pool = ConnectionPool()  # общий для всех экземпляров, ключ - host
+    _sessions = {}  # (host, username, password) -> REST
+    _sessions_lock = threading.Lock()  # под ним нет ввода-вывода
+    login_path = '/login'
+
+    def __init__(self, host=None, cache=None, username=None, password=None, login=None):
         self.rest = host
         self.username = username
         self.password = password
         self.cache = cache
+        self.login = login  # login(Request) - авторизация, вызывается при первом запросе и истечении сессии
+        self._login_lock = threading.Lock()
         self._cookie = []
         self.cookie = None
         self.path = '/'
 
+    @classmethod
+    def session(cls, host=None, username=None, password=None, login=None, pool=None, **kwargs):
+        """
+        Авторизованная сессия, общая для всех запросов и green threads с этими учётными данными.
+        :param pool: лимиты общего пула соединений (maxsize, idle_timeout, wait), см. ConnectionPool.configure
+        """
+        if pool:
+            cls.pool.configure(**pool)
+        key = (host, username, password)
+        with cls._sessions_lock:
+            rest = cls._sessions.get(key)
+            if rest is None:
+                rest = cls._sessions[key] = cls(host=host, username=username, password=password, login=login, **kwargs)
+        return rest
+
     def __getattr__(self, item):
         return partial(self._request, item)
 
-    def _request(self, method, url, no_json=False, verbose=False, headers={}, body=None, redirect=True, timeout=30):
+    def _expired(self, status, header):
+        return status == 401 or status == 302 and self.login_path in urlparse(header.get('location', '')).path
+
+    def _relogin(self, seen):
+        """Single-flight: логинится только первый заметивший, остальные ждут и используют новую cookie"""
+        with self._login_lock:
+            if self.cookie != seen: return
+            logger.debug("Logging in to %s", self.rest)
+            self.login(Request(source=self))
+
+    def _request(self, method, url, no_json=False, verbose=False, headers={}, body=None, redirect=True, timeout=30,
+                 relogin=True):
+        """
+        :param relogin: при отсутствии или истечении сессии залогиниться (self.login) и повторить запрос один раз;
+        запросы самого login должны передавать False
+        """
         method = method.upper()
-        rc = http.client.HTTPConnection(self.rest, timeout=timeout)
+        headers = {**headers}
+        relogin = relogin and self.login is not None
+        if relogin and self.cookie is None:
+            self._relogin(None)
+        cookie = self.cookie
 
         if isinstance(body, (dict,)) and not no_json:
             try:
@@ -105,11 +368,14 @@ class REST:
 
         path = self.path if not url.startswith('/') else ''
 
-        rc.request(method, path + url, body=body, headers=headers)
-        res = rc.getresponse()
-        response = res.read()
+        res, response = self._send(method, path + url, body, headers, timeout)
         header = {k.lower(): v for k, v in res.getheaders()}
 
+        if relogin and self._expired(res.status, header):
+            self._relogin(cookie)
+            return self._request(method, url, no_json=no_json, verbose=verbose, headers=headers, body=body,
+                                 redirect=redirect, timeout=timeout, relogin=False)
+
         if 'set-cookie' in header:
             self._cookie = [i.strip(' \r\n') for i in header['set-cookie'].split(';')]
             self.cookie = self._cookie[0]
@@ -119,16 +385,43 @@ class REST:
                     if not self.path.endswith('/'): self.path += '/'
 
         if redirect and res.status == 302:
+            # GET после редиректа без тела: тело, не прочитанное сервером, испортит следующий запрос в keep-alive соединении
             path = urlparse(header['location']).path
-            return self._request('GET', path, no_json=no_json, verbose=verbose, headers=headers, body=body,
-                                 redirect=redirect, timeout=timeout)
+            headers = {k: v for k, v in headers.items() if k.lower() not in ('content-type', 'content-length')}
+            return self._request('GET', path, no_json=no_json, verbose=verbose, headers=headers, body=None,
+                                 redirect=redirect, timeout=timeout, relogin=relogin)
 
         if not no_json:
             try:
                 response = json.loads(response.decode('utf-8'))
             except:
                 pass
-        rc.close()
         if verbose:
             return res.status, res.reason, header, response
         return response
+
+    def _send(self, method, url, body, headers, timeout):
+        """
+        Запрос через соединение из пула. Если переиспользованный сокет оказался закрыт сервером - один повтор на новом.
+        :return: (response, body)
+        """
+        while True:
+            rc, reused = self.pool.get(self.rest, timeout=timeout)
+            try:
+                rc.request(method, url, body=body, headers=headers)
+                res = rc.getresponse()
+                response = res.read()
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    ConnectionResetError, BrokenPipeError) as e:
+                self.pool.discard(self.rest, rc)
+                if not reused: raise e
+                self.pool.retried()
+                continue
+            except BaseException:
+                self.pool.discard(self.rest, rc)
+                raise
+            if res.will_close:
+                self.pool.discard(self.rest, rc)
+            else:
+                self.pool.put(self.rest, rc)
+            return res, response
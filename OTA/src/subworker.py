@@ -1,3 +1,4 @@
+import json
 import logging
 import re
 import sys
@@ -5,9 +6,82 @@ from types import ModuleType
 
 from config import Config
 
+_REGEX_CHARS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+class Router:
+    """
+    Таблица маршрутов субворкеров.
+    Литеральные маршруты ищутся в dict. Регулярные группируются по литеральному префиксу
+    (до последнего '/' перед первым спецсимволом), каждая группа компилируется в один
+    объединённый паттерн после регистрации. Литеральные маршруты и более длинные префиксы имеют приоритет.
+    """
+
+    def __init__(self):
+        self._static = {}  # path -> {METHOD: handler}
+        self._dynamic = {}  # prefix -> {regex: {METHOD: handler}}, порядок регистрации сохраняется
+        self._compiled = {}  # prefix -> (pattern | [patterns], [tables])
+        self._dirty = False
+
+    @staticmethod
+    def methods(obj):
+        return {name: getattr(obj, name) for name in dir(obj)
+                if name.isupper() and callable(getattr(obj, name, None))}
+
+    @staticmethod
+    def prefix(route):
+        if '|' in route:
+            return ''
+        literal = route[:_REGEX_CHARS.search(route).start()]
+        if route[len(literal)] in '*+?{':  # квантификатор относится к последнему литеральному символу
+            literal = literal[:-1]
+        return literal[:literal.rfind('/') + 1]
+
+    def add(self, route, obj):
+        table = self.methods(obj)
+        if _REGEX_CHARS.search(route):
+            for routes in self._dynamic.values():
+                routes.pop(route, None)
+            self._dynamic.setdefault(self.prefix(route), {})[route] = table
+            self._dirty = True
+        else:
+            self._static[route] = table
+
+    def compile(self):
+        self._compiled = {}
+        for prefix, routes in self._dynamic.items():
+            if not routes: continue
+            try:
+                pattern = re.compile('|'.join(f'(?P<_r{i}>{r})' for i, r in enumerate(routes)))
+            except re.error:  # конфликт имён групп в пользовательских regex
+                pattern = [re.compile(r) for r in routes]
+            self._compiled[prefix] = (pattern, list(routes.values()))
+        self._dirty = False
+
+    def lookup(self, path):
+        table = self._static.get(path)
+        if table is not None:
+            return table
+        if self._dirty:
+            self.compile()
+        end = len(path)
+        while end >= 0:
+            end = path.rfind('/', 0, end)
+            prefix = path[:end + 1]
+            if prefix in self._compiled:
+                pattern, tables = self._compiled[prefix]
+                if type(pattern) is list:
+                    for i, regex in enumerate(pattern):
+                        if regex.fullmatch(path): return tables[i]
+                else:
+                    match = pattern.fullmatch(path)
+                    if match: return tables[int(match.lastgroup[2:])]
+        return None
+
 
 class SubWorker:
     __data__ = {}  # threadsafe хранилище
+    __router__ = Router()
 
     def __init__(self, **kwargs):
         if self.__class__ is not SubWorker:
@@ -24,6 +98,7 @@ class SubWorker:
                 __route__ = getattr(self, '__route__')
 
             self.__data__[__route__] = self
+            self.__router__.add(__route__, self)
 
     @staticmethod
     def register(root, **kwargs):
@@ -33,19 +108,58 @@ class SubWorker:
                 SubWorker.register(obj, **kwargs)
             elif hasattr(obj, 'mro') and SubWorker in obj.mro()[1:]:
                 obj(**kwargs)
+        SubWorker.__router__.compile()
 
     @staticmethod
     def dispatch(method, path):
-        for regex, obj in SubWorker().__data__.items():
-            match = re.match(f'^{regex}$', path)
-            if match:
-                func = getattr(obj, method.upper(), None)
-                if func: return func
-                raise DispatchError('405 Method Not Allowed',
-                                    message=f"Can't call method '{method}'")  # не найден метод в субворкере
-        else:
+        table = SubWorker.__router__.lookup(path)
+        if table is None:
             raise DispatchError('404 Not Found',
                                 message=f"Path '{path}' is not exists")  # не найден подходящий субворкер
+        func = table.get(method.upper())
+        if func: return func
+        raise DispatchError('405 Method Not Allowed',
+                            message=f"Can't call method '{method}'")  # не найден метод в субворкере
+
+
+def stream_response(result, status=1, chunk_size=64 * 1024, batch=500):
+    """
+    Инкрементальная сериализация конверта {'status': ..., 'response': ...}, байт в байт как json.dumps.
+    Строка JSON целиком не собирается: отдаются куски байт размером около chunk_size. Список верхнего уровня
+    кодируется пачками по batch элементов через json.dumps (C-кодировщик); JSONEncoder.iterencode всегда
+    идёт чистым Python, поэтому остаётся только для прочих значений.
+    """
+    head = '{"status": ' + json.dumps(status) + ', "response": '
+    if type(result) is list:
+        parts = _list_parts(result, batch)
+    else:
+        parts = json.JSONEncoder().iterencode(result)
+    buf, size = [head], len(head)
+    for part in parts:
+        buf.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(buf).encode('utf-8')
+            buf, size = [], 0
+    buf.append('}')
+    yield ''.join(buf).encode('utf-8')
+
+
+def _list_parts(items, batch):
+    yield '['
+    for i in range(0, len(items), batch):
+        part = json.dumps(items[i:i + batch])[1:-1]
+        yield ', ' + part if i else part
+    yield ']'
+
+
+def response_body(result):
+    """Тело ответа WSGI из результата субворкера: str, bytes или итерируемое кусков (см. stream_response)"""
+    if isinstance(result, str):
+        return [result.encode('utf-8')]
+    if isinstance(result, bytes):
+        return [result]
+    return (i.encode('utf-8') if isinstance(i, str) else i for i in result)
 
 
 class DispatchError(Exception):
@@ -0,0 +1,411 @@
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import eventlet
+import pytest
+
+from cache import DiskCache, InMemoryCache
+from decoder import ZeepDecoder
+from request import REST, SOAP, ConditionalTransport, ConnectionPool, Future, Request
+from subworker import Router, response_body, stream_response
+from workers.ota_worker import LoginForm
+
+
+def call(value, delay=0, error=None):
+    eventlet.sleep(delay)
+    if error is not None:
+        raise error
+    return value
+
+
+def test_gather_results_in_order():
+    futures = [Future(call, 1, delay=0.02), Future(call, 2), Future(call, 3, error=ValueError('bad'))]
+    results = Request.gather(*futures, return_exceptions=True)
+    assert results[:2] == [1, 2] and isinstance(results[2], ValueError)
+    with pytest.raises(ValueError):
+        Request.gather(Future(call, 1), Future(call, 2, error=ValueError('bad')))
+
+
+def test_future_deadline():
+    future = Future(call, 1, delay=1, deadline=0.05)
+    with pytest.raises(TimeoutError):
+        future.result()
+
+
+def test_gather_timeout_raises_and_cancels():
+    futures = [Future(call, 1), Future(call, 2, delay=3), Future(call, 3, delay=3)]
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        Request.gather(*futures, timeout=0.1)
+    assert time.monotonic() - started < 1
+    assert all(f.done() for f in futures) and futures[1].cancelled and futures[2].cancelled
+
+
+def test_gather_timeout_with_return_exceptions():
+    futures = [Future(call, 1), Future(call, 2, delay=3), Future(call, 3, delay=0.01), Future(call, 4, delay=3)]
+    started = time.monotonic()
+    results = Request.gather(*futures, timeout=0.1, return_exceptions=True)
+    assert time.monotonic() - started < 1
+    assert results[0] == 1 and results[2] == 3
+    assert isinstance(results[1], TimeoutError) and isinstance(results[3], TimeoutError)
+    assert futures[1].cancelled and futures[3].cancelled and not futures[2].cancelled
+
+
+class Value:
+    """Аналог zeep CompoundValue"""
+
+    def __init__(self, **kwargs):
+        self.__values__ = OrderedDict(kwargs)
+
+    def __json__(self):
+        return self.__values__
+
+
+def test_decoder_full_and_projected():
+    res = Value(campaigns=[Value(id=1, name='Campaign 1\r\n', tags=['a\n', 2], target=Value(type='SIM', filter=None))],
+                total=1)
+    expected = {'campaigns': [{'id': 1, 'name': 'Campaign 1', 'tags': ['a', 2],
+                               'target': {'type': 'SIM', 'filter': None}}], 'total': 1}
+    decoder = ZeepDecoder()
+    assert decoder.decode(res) == expected
+    out = io.StringIO()
+    decoder.dump(res, out)
+    assert json.loads(out.getvalue()) == expected == json.loads(''.join(decoder.iterencode(res)))
+
+    projected = ZeepDecoder({'campaigns': {'id': True, 'target': {'type': True}}})
+    assert projected.decode(res) == {'campaigns': [{'id': 1, 'target': {'type': 'SIM'}}]}
+    assert json.loads(''.join(projected.iterencode(res))) == projected.decode(res)
+
+
+def test_decoder_deeper_than_recursion_limit():
+    res = 'leaf'
+    for _ in range(5000):
+        res = Value(child=res)
+    node = ZeepDecoder().decode(res)
+    for _ in range(5000):
+        node = node['child']
+    assert node == 'leaf'
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path), timeout=60)
+    cache.add('http://ota/wsdl', '<definitions/>')
+    cache.add('http://ota/copy.xsd', b'<definitions/>')  # тот же документ - один объект
+    assert len(os.listdir(tmp_path / 'objects')) == 1 and len(os.listdir(tmp_path / 'index')) == 2
+
+    restarted = DiskCache(str(tmp_path), timeout=60)  # другой процесс или перезапуск
+    assert restarted.get('http://ota/wsdl') == b'<definitions/>'
+    assert restarted.get('http://ota/other.xsd') is None
+    restarted._timeout = 0.01
+    time.sleep(0.02)
+    assert restarted.get('http://ota/wsdl') is None  # устарел
+
+
+def test_disk_cache_trims_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=250)
+    cache.touch_interval = 0
+    cache.add('a', 'a' * 100)
+    cache.add('b', 'b' * 100)
+    time.sleep(0.01)
+    assert cache.get('a') == b'a' * 100  # b теперь давнее a
+    cache.add('c', 'c' * 100)
+    assert cache.get('b') is None and cache.get('a') and cache.get('c')
+    assert len(os.listdir(tmp_path / 'objects')) == 2 and len(os.listdir(tmp_path / 'index')) == 2
+
+
+def test_disk_cache_overwrite_and_stale_files(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=250)
+    for i in range(10):
+        cache.add('http://ota/wsdl', f'{i:03d}' + 'x' * 97)  # новая версия документа по тому же url
+    assert os.listdir(tmp_path / 'objects') == [cache._lookup('http://ota/wsdl')['digest']]
+    assert cache.get('http://ota/wsdl') == b'009' + b'x' * 97
+
+    stale = time.time() - 2 * cache.stale_tmp
+    for name in ('objects/.tmpcrashed', 'objects/' + 'f' * 64):  # недописанный файл и объект без записи
+        (tmp_path / name).write_bytes(b'x' * 100)
+        os.utime(tmp_path / name, (stale, stale))
+    cache.add('http://ota/xsd', 'y' * 100)
+    assert sorted(os.listdir(tmp_path / 'objects')) == sorted(cache._lookup(url)['digest']
+                                                             for url in ('http://ota/wsdl', 'http://ota/xsd'))
+
+
+class WsdlHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'<definitions/>'
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_conditional_transport_revalidates_expired_documents(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WsdlHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/wsdl'
+    try:
+        cache = DiskCache(str(tmp_path), timeout=0.05)
+        transport = ConditionalTransport(cache=cache)
+        assert transport.load(url) == b'<definitions/>'
+        assert transport.load(url) == b'<definitions/>'  # из кэша, без запроса
+        time.sleep(0.1)
+        assert transport.load(url) == b'<definitions/>'  # истёк - 304 и продление
+        assert WsdlHandler.requests == [None, '"v1"'] and cache.get(url) == b'<definitions/>'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def memory_cache():
+    max_size = InMemoryCache.max_size
+    InMemoryCache.clear()
+    yield InMemoryCache
+    InMemoryCache.configure(max_size)
+    InMemoryCache.clear()
+
+
+def test_memory_cache_lru_budget(memory_cache):
+    memory_cache.configure(250)
+    cache = InMemoryCache()
+    cache.add('a', 'a' * 100)
+    cache.add('b', 'b' * 100)
+    assert cache.get('a') == 'a' * 100  # b теперь давнее a
+    cache.add('c', 'c' * 100)
+    assert cache.get('b') is None and cache.get('a') and cache.get('c')
+    cache.add('huge', 'x' * 300)  # больше всего бюджета - не кэшируется
+    assert cache.get('huge') is None and cache.get('a')
+    assert InMemoryCache.info()['size'] == 200
+
+    memory_cache.configure(150)
+    assert InMemoryCache.info()['entries'] == 1 and cache.get('a')
+
+
+def test_memory_cache_ttl_and_shared_budget(memory_cache):
+    short, default = InMemoryCache(timeout=0.01), InMemoryCache()
+    short.add('wsdl', b'<definitions/>')
+    assert default.get('wsdl') == b'<definitions/>'  # кэш общий для всех экземпляров
+    time.sleep(0.02)
+    assert default.get('wsdl') is None and InMemoryCache.stats['expirations'] >= 1
+    with pytest.raises(TypeError):
+        InMemoryCache(max_size=1)  # бюджет только через configure()
+
+
+@pytest.mark.parametrize('result', [
+    [{'id': i, 'name': f'Campaign {i}\u00e9', 'tags': [i, None, True]} for i in range(1234)],
+    [],
+    {'message': 'Fault'},
+    'done',
+])
+def test_stream_response_matches_json_dumps(result):
+    chunks = list(stream_response(result, chunk_size=1024, batch=100))
+    assert b''.join(chunks) == json.dumps({'status': 1, 'response': result}).encode('utf-8')
+    assert all(type(chunk) is bytes for chunk in chunks) and (len(chunks) > 1 or len(chunks[0]) < 2048)
+
+
+def test_response_body():
+    assert response_body('{}') == [b'{}'] and response_body(b'{}') == [b'{}']
+    assert list(response_body(iter(['{"a": ', b'1}']))) == [b'{"a": ', b'1}']
+    assert b''.join(response_body(stream_response([1, 2]))) == b'{"status": 1, "response": [1, 2]}'
+
+
+class Handler:
+    def __init__(self, name):
+        self.name = name
+
+    def GET(self):
+        return self.name
+
+
+def test_router_static_and_dynamic_routes():
+    router = Router()
+    router.add('/ota/v1/probe', Handler('probe'))
+    router.add(r'/ota/v1/sim/\d+', Handler('sim'))
+    router.add(r'/ota/v1/.*', Handler('any'))
+    router.add(r'/(?P<id>\d+)/a', Handler('a'))
+    router.add(r'/(?P<id>\d+)/b', Handler('b'))  # та же группа - паттерны проверяются по одному
+    router.compile()
+    assert router.lookup('/ota/v1/probe')['GET']() == 'probe'  # литеральный маршрут важнее regex
+    assert router.lookup('/ota/v1/sim/42')['GET']() == 'sim'  # более длинный префикс
+    assert router.lookup('/ota/v1/sim/x')['GET']() == 'any'
+    assert router.lookup('/7/b')['GET']() == 'b'
+    assert router.lookup('/ota/v2/probe') is None
+
+    router.add(r'/ota/v2/.*', Handler('v2'))  # пересборка при следующем lookup
+    assert router.lookup('/ota/v2/probe')['GET']() == 'v2'
+
+
+LOGIN_PAGE = (
+    '<html><body><form id="loginForm" method="post" action="/ota/j_spring_security_check">'
+    '<input type="hidden" name="buildversion" value="1.0.10"/>'
+    '<input type="text" name="j_username" value="" class="field"/>'
+    '<input type="password" name="j_password" value="" class="field"/>'
+    '<input type="submit" name="submit" value="Login"/>'
+    '</form></body></html>').encode('utf-8')
+
+
+def test_login_form():
+    form = LoginForm.get(LOGIN_PAGE, etag='"v1"')
+    assert (form.method, form.action) == ('post', '/ota/j_spring_security_check')
+    assert form.body('user', 'secret') == 'buildversion=1.0.10&j_username=user&j_password=secret'
+    assert LoginForm.get(LOGIN_PAGE, etag='"v1"') is form and LoginForm.get(LOGIN_PAGE) is not form
+
+
+class OtaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(200, json.dumps({'path': self.path, 'port': self.client_address[1]}).encode('utf-8'))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply(302, headers=[('Location', '/ota/done')])
+
+
+@pytest.fixture
+def ota_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OtaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_rest_reuses_pooled_connections(ota_server):
+    rest = REST(host=ota_server)
+    rest.pool = ConnectionPool(maxsize=2)
+    first, second = rest.get('/ota/a'), rest.get('/ota/b')
+    assert first['path'] == '/ota/a' and second['port'] == first['port']  # то же keep-alive соединение
+    assert rest.pool.stats['hits'] == 1 and rest.pool.stats['misses'] == 1
+
+
+def test_rest_redirect_after_post_keeps_connection_usable(ota_server):
+    rest = REST(host=ota_server)
+    rest.pool = ConnectionPool(maxsize=1)
+    assert rest.post('/ota/form', body={'u': 'x', 'p': 'y'})['path'] == '/ota/done'
+    assert rest.get('/ota/next')['path'] == '/ota/next'  # тело POST не ушло в GET после редиректа
+
+
+def test_connection_pool_evicts_idle():
+    pool = ConnectionPool(maxsize=1, idle_timeout=0.01)
+    conn, reused = pool.get('127.0.0.1:1')
+    assert not reused
+    pool.put('127.0.0.1:1', conn)
+    time.sleep(0.02)
+    pool.evict()
+    assert pool.stats['evictions'] == 1
+    assert pool.get('127.0.0.1:1', timeout=1)[1] is False
+
+
+def test_connection_pool_limits_from_config(monkeypatch):
+    pool = ConnectionPool()
+    monkeypatch.setattr(REST, 'pool', pool)
+    REST.session(host='ota:2', username='u', password='p', pool={'maxsize': 1, 'wait': 0.05})
+    assert (pool.maxsize, pool.idle_timeout, pool.wait) == (1, 60, 0.05) and pool._lock is None
+    pool.get('ota:2')
+    with pytest.raises(TimeoutError):
+        pool.get('ota:2')  # единственный слот занят
+
+
+def test_rest_session_is_shared():
+    assert REST.session(host='ota:1', username='u', password='p') is REST.session(host='ota:1', username='u', password='p')
+    assert REST.session(host='ota:1', username='u', password='q') is not REST.session(host='ota:1', username='u', password='p')
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'OK' if status == 200 else 'Unauthorized'
+
+    def getheaders(self):
+        return []
+
+
+def test_rest_relogin_is_single_flight():
+    logins = []
+
+    def login(ota):
+        time.sleep(0.05)
+        logins.append(1)
+        ota.source.cookie = f'SESSION={len(logins)}'
+
+    rest = REST(host='ota:1', login=login)
+    rest.cookie = 'SESSION=expired'
+
+    def send(method, url, body, headers, timeout):
+        ok = headers.get('Cookie') == rest.cookie != 'SESSION=expired'
+        return FakeResponse(200 if ok else 401), b'{"ok": true}' if ok else b''
+
+    rest._send = send
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(rest.get('/ota/list'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{'ok': True}] * 8 and len(logins) == 1
+
+
+@pytest.fixture
+def soap_builds(monkeypatch):
+    builds = []
+
+    def build(self):
+        builds.append((self.wsdl, self.username, self.password))
+        return object()
+
+    monkeypatch.setattr(SOAP, '_build', build)
+    monkeypatch.setattr(SOAP, '_clients', {})
+    return builds
+
+
+def test_soap_clients_are_built_lazily_and_shared(soap_builds):
+    a = SOAP(wsdl='http://ota/wsdl', auth='Basic', username='u', password='p')
+    same = SOAP(wsdl='http://ota/wsdl', auth='basic', username='u', password='p')
+    other = SOAP(wsdl='http://ota/wsdl', auth='basic', username='u', password='q')
+    assert soap_builds == []  # WSDL не разбирается до первого вызова
+    for _ in range(3):
+        assert a.client is same.client and other.client is not a.client
+    assert len(soap_builds) == 2  # разные пароли - разные клиенты, без пересборки на каждом обращении
+
+
+def test_soap_refresh_and_invalidate(soap_builds):
+    a = SOAP(wsdl='http://ota/wsdl', auth='basic', username='u', password='p')
+    b = SOAP(wsdl='http://ota/other', auth='basic', username='u', password='p')
+    client, other = a.client, b.client
+    assert a.refresh() is not client and b.client is other and len(soap_builds) == 3
+    SOAP.invalidate(username='u')
+    assert a.client is not client and b.client is not other and len(soap_builds) == 5
+    SOAP.invalidate(wsdl='http://ota/other', auth='BASIC')
+    b.client
+    a.client
+    assert len(soap_builds) == 6
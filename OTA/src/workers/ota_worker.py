@@ -3,10 +3,55 @@
 
 # import json
 
+import hashlib
 import re
 from urllib.parse import urlparse
 from request import *
-from subworker import SubWorker
+from subworker import SubWorker, stream_response
+
+_FORM_TAGS = re.compile(r'\<(form|input) +(.*?) */?\>')
+_FORM_ATTRS = re.compile(r' ?(\w+)="([^"]*?)"')
+
+
+class LoginForm:
+    """
+    Описание формы логина (method, action, поля), разобранное один раз на версию страницы.
+    Версия - ETag страницы или хэш её содержимого; тело запроса собирается заранее.
+    """
+
+    _forms = {}  # ETag/хэш страницы -> LoginForm
+    USERNAME, PASSWORD = object(), object()
+
+    def __init__(self, page):
+        form = [(i[0], dict(_FORM_ATTRS.findall(i[1]))) for i in _FORM_TAGS.findall(page.decode('utf-8'))]
+        self.method = form[0][1]['method']
+        self.action = form[0][1]['action']
+        self.fields = []  # (name, value | USERNAME | PASSWORD)
+        for _, p in form[1:]:
+            if p['type'] == 'hidden':
+                self.fields.append((p['name'], p['value']))
+            elif p['type'] == 'text':
+                self.fields.append((p['name'], self.USERNAME))
+            elif p['type'] == 'password':
+                self.fields.append((p['name'], self.PASSWORD))
+        self._bodies = {}
+
+    @classmethod
+    def get(cls, page, etag=None):
+        key = etag or hashlib.sha1(page).digest()
+        form = cls._forms.get(key)
+        if form is None:
+            if len(cls._forms) >= 16: cls._forms.clear()
+            form = cls._forms[key] = cls(page)
+        return form
+
+    def body(self, username, password):
+        body = self._bodies.get((username, password))
+        if body is None:
+            values = {self.USERNAME: username, self.PASSWORD: password}
+            body = self._bodies[(username, password)] = '&'.join(
+                name + '=' + (values[value] if value in values else value) for name, value in self.fields)
+        return body
 
 
 class RegisterSIM(SubWorker):
@@ -25,13 +70,9 @@ class RegisterSIM(SubWorker):
         # 'Referer': 'http://10.77.66.9:8080/ota/login?buildversion=1.0.10+build+2467',
     }
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.cookie = None
-
     def TEST(self, env, response):
-        ota = Request(source=REST(**self.cfg.ota_rest))
-        self.login(ota)
+        # сессия общая для запросов: логин только при первом обращении и после истечения cookie
+        ota = Request(source=REST.session(login=self.login, **self.cfg.ota_rest))
 
         result = 'done'
         # self.log.debug('TEST: %s %s', repr(result), repr(header))
@@ -41,7 +82,7 @@ class RegisterSIM(SubWorker):
         self.log.debug('CAMPAINGS: %s %s %s %s %s', status, repr(reason), repr(header), repr(result), type(result))
 
         response("200 OK", [('Content-Type', 'application/json; utf-8')])
-        return json.dumps({'status': 1, 'response': result})
+        return stream_response(result)
 
     def POST(self, env, response):
         result = ''
@@ -50,30 +91,18 @@ class RegisterSIM(SubWorker):
         return json.dumps({'status': 1, 'response': result})
 
     def login(self, ota):
-        status, reason, header, result = ota.get('/ota/', headers=self.header, verbose=True, no_json=True)
+        status, reason, header, result = ota.get('/ota/', headers=self.header, verbose=True, no_json=True, relogin=False)
         # self.log.debug('TEST: %s %s %s %s', status, repr(reason), repr(header), repr(result))
         if status == 200:
-            form = re.findall(r'\<(form|input) +(.*?) */?\>', result.decode('utf-8'))
-            form = [(i[0], dict(re.findall(r' ?(\w+)="([^"]*?)"', i[1]))) for i in form]
-            # self.log.debug('FORM: %s', repr(form))
-            body = []
-            for _, p in form[1:]:
-                if p['type'] == 'hidden':
-                    body.append(p['name'] + '=' + p['value'])
-                elif p['type'] == 'text':
-                    body.append(p['name'] + '=' + self.cfg.ota_rest.username)
-                elif p['type'] == 'password':
-                    body.append(p['name'] + '=' + self.cfg.ota_rest.password)
-            else:
-                body = '&'.join(body)
-            # self.log.debug('BODY: %s', body)
+            form = LoginForm.get(result, header.get('etag'))
             status, reason, header, result = ota(
-                form[0][1]['method'],
-                form[0][1]['action'],
+                form.method,
+                form.action,
                 headers={**self.header, 'content-type': 'application/x-www-form-urlencoded'},
                 verbose=True,
                 no_json=True,
-                body=body)
+                body=form.body(self.cfg.ota_rest.username, self.cfg.ota_rest.password),
+                relogin=False)
             # self.log.debug('LOGIN_OK: %s %s %s %s', status, repr(reason), repr(header), repr(result))
 
 
@@ -105,5 +134,5 @@ class ApiListCampaign(SubWorker):
             # res = {'message': e.message, 'content': e.content}
             res = {'message': e.message}
 
-        self.log.debug('%d %s %s', request_num, 'response:', len(json.dumps(res)))
-        return json.dumps({'status': 1, 'response': res})
+        self.log.debug('%d %s %s', request_num, 'response:', len(res))
+        return stream_response(res)
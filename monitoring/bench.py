@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Синтетические бенчмарки мониторинга.
+Запуск из monitoring: python3 bench.py [name ...]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from inventory import Inventory
+from main import prepare_data_for_updater
+from scheduler import Scheduler
+
+BENCHES = {}
+
+
+def bench(func):
+    BENCHES[func.__name__] = func
+    return func
+
+
+def report(name, number, seconds):
+    print(f'{name:<48} {number / seconds:>12.0f} op/s {seconds / number * 1e6:>10.2f} us/op')
+
+
+@bench
+def scheduler(devices=50000, interval=1, probe=0.01, duration=5, workers=500):
+    """Проверки в секунду: задача на устройство со sleep(interval) против общего планировщика"""
+    done = [0]
+
+    async def check():
+        await asyncio.sleep(probe)  # ожидание ответа устройства
+        done[0] += 1
+        return interval
+
+    async def legacy():
+        async def monitoring():
+            while True:
+                await asyncio.sleep(await check())
+
+        tasks = [asyncio.ensure_future(monitoring()) for _ in range(devices)]
+        await asyncio.sleep(duration)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def scheduled():
+        s = Scheduler(workers=workers, jitter=0.1, spread=interval)
+        for i in range(devices):
+            s.add(i, check)
+        runner = asyncio.ensure_future(s.run())
+        await asyncio.sleep(duration)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        return s
+
+    done[0] = 0
+    started = time.monotonic()
+    asyncio.run(legacy())
+    report(f'checks legacy task per device  {devices} devices', done[0], time.monotonic() - started)
+
+    done[0] = 0
+    started = time.monotonic()
+    s = asyncio.run(scheduled())
+    report(f'checks scheduler {workers:>4} workers   {devices} devices', done[0], time.monotonic() - started)
+    print(f'{"scheduler max lag":<48} {s.metrics["max_lag"]:>12.3f} s')
+
+
+def _controllers(count):
+    return [{
+        'id': i, 'name': f'Controller {i}', 'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', 'port': '161',
+        'location': {'lat': 55.75 + i * 1e-6, 'lon': 37.61}, 'has_spot': bool(i % 2),
+        'spot_ip': f'10.200.{i >> 8 & 255}.{i & 255}', 'spot_port': 8080,
+    } for i in range(count)]
+
+
+@bench
+def inventory(sizes=(10000, 100000), changes=0.01, legacy_max=20000):
+    """
+    Обновление выгрузки с 1% изменившихся устройств: пересборка и сравнение всех конфигов
+    против диффа по хэшам. Прежний вариант квадратичный, поэтому меряется только до legacy_max.
+    """
+    device = {'name': 'Контроллеры', 'type': 'controllers', 'checks': ['snmp'], 'url': '/controllers', 'timeout': 5}
+
+    async def legacy_refresh(monitors, data):
+        inactive_monitors = list(monitors.keys())
+        restarted = 0
+        for d in data:
+            c = await prepare_data_for_updater(device, 'controllers', d)
+            if d['id'] not in monitors:
+                monitors[d['id']] = dict(info=c)
+            elif monitors[d['id']]['info'] != c:
+                monitors[d['id']] = dict(info=c)
+                inactive_monitors.remove(d['id'])
+                restarted += 1
+            if d['id'] in inactive_monitors:
+                inactive_monitors.remove(d['id'])
+        return restarted
+
+    async def refresh(inventory, monitors, data):
+        changed, removed = inventory.diff(data)
+        restarted = 0
+        for d in changed:
+            c = await prepare_data_for_updater(device, 'controllers', d)
+            if d['id'] in monitors and monitors[d['id']]['info'] != c:
+                restarted += 1
+            monitors[d['id']] = dict(info=c)
+            inventory.applied(d)
+        return restarted
+
+    def measure(func, *state, data, refreshed):
+        asyncio.run(func(*state, data))
+        started = time.perf_counter()
+        assert asyncio.run(func(*state, refreshed)) == int(len(data) * changes)
+        return time.perf_counter() - started
+
+    for size in sizes:
+        data = _controllers(size)
+        refreshed = [dict(d) for d in data]
+        for d in random.sample(refreshed, int(size * changes)):
+            d['port'] = '162'
+        random.shuffle(refreshed)  # порядок выгрузки SB не гарантирован
+        if size <= legacy_max:
+            report(f'inventory legacy full compare  {size:>6} devices', 1,
+                   measure(legacy_refresh, {}, data=data, refreshed=refreshed))
+        report(f'inventory hash diff            {size:>6} devices', 1,
+               measure(refresh, Inventory(), {}, data=data, refreshed=refreshed))
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHES:
+        BENCHES[name]()
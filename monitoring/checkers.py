@@ -1,33 +1,221 @@
-import os
+import time
 import errors
 import aiohttp
 import asyncio
-import aiosnmp
 import logging
+import icmp
+import snmp
+from icmp import Pinger
+from snmp import SnmpPoller
+from ssh import ServiceMux
 
 LOCAL = [
     'localhost',
     '127.0.0.1',
 ]
 
-checker_aiosession = aiohttp.ClientSession()
+pinger = Pinger()
+snmp_poller = SnmpPoller(community='UTMC')
+service_mux = ServiceMux()
 
-async def ping(host: str, timeout: int = 1):
+
+class CheckResult(tuple):
+    """
+    Результат проверки. Распаковывается и сравнивается как прежний кортеж (ok, error),
+    дополнительно хранит наблюдённое состояние компонентов и длительность проверки.
+    """
+
+    def __new__(cls, ok: bool, error: str = '', components: dict = None, latency: float = None,
+                timing: dict = None):
+        self = super().__new__(cls, (ok, error))
+        self.components = components or {}  # например {'controller': True, 'spot': False}
+        self.latency = latency  # секунды
+        self.timing = timing  # фазы HTTP-запроса, см. HttpProbe.timing
+        return self
+
+    @property
+    def ok(self) -> bool:
+        return self[0]
+
+    @property
+    def error(self) -> str:
+        return self[1]
+
+
+class HttpProbe:
+    """Результат HTTP-проверки с разбивкой по фазам, секунды (None - фазы не было)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.method = None
+        self.status = None
+        self.error = None
+        self.started = time.monotonic()
+        self.dns = None  # разрешение имени, None - из кэша
+        self.connect = None  # TCP-соединение без DNS, None - переиспользовано keep-alive
+        self.ttfb = None  # от отправки заголовков до заголовков ответа
+        self.total = None
+        self._marks = {}
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and 200 <= self.status < 300
+
+    def timing(self) -> dict:
+        return {'method': self.method, 'status': self.status, 'dns': self.dns, 'connect': self.connect,
+                'ttfb': self.ttfb, 'total': self.total}
+
+    def __repr__(self):
+        return f'HttpProbe({self.url}, {self.method} {self.status}, {self.timing()})'
+
+
+_HEAD_REJECTED = (aiohttp.ServerDisconnectedError, aiohttp.ClientResponseError, aiohttp.ClientPayloadError)
+
+
+def _mark(name: str):
+    async def hook(session, ctx, params):
+        probe = ctx.trace_request_ctx
+        if isinstance(probe, HttpProbe):
+            probe._marks[name] = time.monotonic()
+    return hook
+
+
+class HttpProber:
+    """
+    HTTP-проверки через одну сессию с пулом keep-alive соединений. Сессия создаётся внутри
+    работающего цикла событий при первом запросе. Сначала HEAD (тело не передаётся и соединение
+    остаётся в пуле), при отказе - GET без чтения тела. Хосты, не поддерживающие HEAD, запоминаются.
+    """
+
+    def __init__(self, limit: int = 1000, limit_per_host: int = 2, dns_ttl: int = 300,
+                 keepalive: float = 30, head: bool = True):
+        self.configure(limit=limit, limit_per_host=limit_per_host, dns_ttl=dns_ttl, keepalive=keepalive, head=head)
+        self.session = None
+        self._loop = None
+        self._no_head = set()  # host:port, где HEAD не работает
+
+    def configure(self, limit: int = None, limit_per_host: int = None, dns_ttl: int = None,
+                  keepalive: float = None, head: bool = None):
+        """Параметры пула; действуют для следующей созданной сессии"""
+        if limit is not None: self.limit = limit
+        if limit_per_host is not None: self.limit_per_host = limit_per_host
+        if dns_ttl is not None: self.dns_ttl = dns_ttl
+        if keepalive is not None: self.keepalive = keepalive
+        if head is not None: self.head = head
+
+    def _session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_event_loop()
+        if self.session is not None and not self.session.closed and self._loop is loop:
+            return self.session
+        trace = aiohttp.TraceConfig()
+        for signal, name in (
+                (trace.on_dns_resolvehost_start, 'dns_start'),
+                (trace.on_dns_resolvehost_end, 'dns_end'),
+                (trace.on_connection_create_start, 'connect_start'),
+                (trace.on_connection_create_end, 'connect_end'),
+                (trace.on_request_headers_sent, 'sent'),
+                (trace.on_request_end, 'headers'),
+        ):
+            signal.append(_mark(name))
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive,
+            ssl=False,
+        )
+        self._loop = loop
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+        return self.session
+
+    async def _request(self, method: str, url: str, timeout: float) -> HttpProbe:
+        probe = HttpProbe(url)
+        probe.method = method
+        try:
+            async with self._session().request(method, url, timeout=aiohttp.ClientTimeout(total=timeout),
+                                               trace_request_ctx=probe) as resp:
+                probe.status = resp.status  # тело не читается
+        except Exception as e:
+            probe.error = e
+        marks = probe._marks
+        if 'dns_end' in marks:
+            probe.dns = marks['dns_end'] - marks['dns_start']
+        if 'connect_end' in marks:
+            probe.connect = marks['connect_end'] - marks['connect_start'] - (probe.dns or 0)
+        if 'headers' in marks:
+            probe.ttfb = marks['headers'] - marks.get('sent', probe.started)
+        probe.total = time.monotonic() - probe.started
+        return probe
+
+    async def probe(self, url: str, timeout: float = 2) -> HttpProbe:
+        origin = url.split('/', 3)[2] if '://' in url else url
+        if self.head and origin not in self._no_head:
+            head = await self._request('HEAD', url, timeout)
+            # GET только если сервер ответил на HEAD отказом или оборвал соединение, а не был недоступен
+            if head.ok or head.status is None and not isinstance(head.error, _HEAD_REJECTED) \
+                    or timeout <= head.total:
+                return head
+            probe = await self._request('GET', url, timeout - head.total)
+            if probe.ok:
+                self._no_head.add(origin)
+            return probe
+        return await self._request('GET', url, timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        self.session = None
+
+
+http_prober = HttpProber()
+
+
+def timed(checker):
+    """Оборачивает результат проверки в CheckResult с длительностью"""
+
+    async def wrapper(config: dict) -> CheckResult:
+        started = time.monotonic()
+        result = await checker(config)
+        if not isinstance(result, CheckResult):
+            result = CheckResult(*result)
+        result.latency = time.monotonic() - started
+        return result
+
+    wrapper.__name__ = checker.__name__
+    wrapper.__doc__ = checker.__doc__
+    return wrapper
+
+
+async def ping(host: str, timeout: int = 1, count: int = 5, strategy: str = icmp.FIRST, stagger: float = 0.2):
     if not host:
         return False
-    results = []
-    for _ in range(5):
-        with open(os.devnull, 'w') as devnull:
-            pr = await asyncio.create_subprocess_shell(
-                f'ping -c 1 -W {str(timeout)} {host}',
-                stdout=devnull,
-                stderr=devnull,
-            )
-        code = await pr.wait()
-        results.append(True if code == 0 else False)
-    return any(results)
+    result = await pinger.ping(host, timeout, count=count, strategy=strategy, stagger=stagger)
+    return result.alive
+
+
+async def first_success(*aws) -> bool:
+    """Запускает проверки одновременно, возвращает True на первой успешной и отменяет остальные"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if await next_done:
+                return True
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
+def ping_options(config: dict) -> dict:
+    return dict(
+        timeout=config.get('timeout', 1),
+        count=config.get('ping_count', 5),
+        strategy=config.get('ping_strategy', icmp.FIRST),
+        stagger=config.get('ping_stagger', 0.2),
+    )
 
+
+@timed
 async def ping_checker(config: dict) -> (bool, str):
     if config.get('model', None) == 'SmartVisionMock':
         return True, ''
@@ -39,13 +227,12 @@ async def ping_checker(config: dict) -> (bool, str):
         return False, errors.NO_CONFIG
     if host in LOCAL or spot_host in LOCAL:
         return True, ''
-    timeout = config.get('timeout', 1)
-    host_ping = await ping(host, timeout)
-    spot_ping = await ping(spot_host, timeout)
-    result = host_ping or spot_ping
+    options = ping_options(config)
+    result = await first_success(ping(host, **options), ping(spot_host, **options))
     return (True, '') if result else (False, errors.NOT_AVAILABLE)
 
 
+@timed
 async def http_checker(config: dict) -> (bool, str):
     if config.get('model', None) == 'SmartVisionMock':
         return True, ''
@@ -53,16 +240,12 @@ async def http_checker(config: dict) -> (bool, str):
     if not url:
         return False, errors.NO_CONFIG
     timeout = config.get('timeout', 2)
-    try:
-        async with checker_aiosession.get(url, timeout=timeout, ssl=False) as resp:
-            status = resp.status
-    except Exception as e:
-        return False, errors.NO_HTTP
-    else:
-        if status not in range(200, 300):
-            return False, errors.NO_HTTP
-    return True, ''
+    probe = await http_prober.probe(url, timeout)
+    if not probe.ok:
+        return CheckResult(False, errors.NO_HTTP, timing=probe.timing())
+    return CheckResult(True, '', timing=probe.timing())
 
+@timed
 async def service_checker(config: dict) -> (bool, str):
     host = config.get('host', None)
     if not host:
@@ -74,24 +257,24 @@ async def service_checker(config: dict) -> (bool, str):
     if not service_name:
         return False, errors.NO_CONFIG
 
-    command = f'systemctl is-active {service_name}'
+    target = None
     if host not in LOCAL:
         ssh_user = config.get('ssh_user', None)
         if not ssh_user:
             return False, errors.NO_CONFIG
-        command = f'ssh -oStrictHostKeyChecking=no -o ConnectTimeout={timeout} {ssh_user}@{host} ' + command
+        target = f'{ssh_user}@{host}'
 
-    with open(os.devnull, 'w') as devnull:
-        pr = await asyncio.create_subprocess_shell(
-            command,
-            stdout=devnull,
-            stderr=devnull,
-        )
-    code = await pr.wait()
-    return (True, '') if code == 0 else (False, errors.NO_SERVICE)
+    active = await service_mux.is_active(target, service_name, timeout)
+    return (True, '') if active else (False, errors.NO_SERVICE)
 
 
+@timed
 async def snmp_checker(config: dict) -> (bool, str):
+    """
+    Контроллер доступен по SNMP или отвечает на ping его spot.
+    Все компоненты опрашиваются одновременно, состояние сохраняется в CheckResult.components
+    (controller - SNMP, spot - ping, spot_http - статистика spot), чтобы его не пришлось перепроверять.
+    """
     host = config.get('host', None)
     port = config.get('port', '161')
     spot_host = None
@@ -100,37 +283,34 @@ async def snmp_checker(config: dict) -> (bool, str):
     if not host and not spot_host:
         return False, errors.NO_CONFIG
     if host in LOCAL:
-        return True, ''
-    snmp_ping = await snmp_get(host, port)
-    spot_ping = await ping(spot_host)
-    result = spot_ping or snmp_ping
-    return (True, '') if result else (False, errors.NO_SNMP)
+        return CheckResult(True, '', {'controller': True, 'spot': False, 'spot_http': False})
+    options = {**ping_options(config), 'timeout': 1}
+    oids = config.get('snmp_oids', [snmp.SYS_NAME])
+    spot_url = f"http://{spot_host}:{config.get('spot_port')}/stats?count=1" if spot_host else None
+    checks = [snmp_poll(host, port, oids), ping(spot_host, **options)]
+    if spot_url:
+        checks.append(http_get(spot_url))
+    polled, spot_ping, *spot_http = await asyncio.gather(*checks)
+    spot_http = spot_http[0] if spot_http else False
+    components = {'controller': polled is not None, 'spot': spot_ping, 'spot_http': spot_http}
+    result = components['controller'] or spot_ping
+    return CheckResult(True, '', components) if result else CheckResult(False, errors.NO_SNMP, components)
 
 
-async def snmp_get(host: str, port: str):
+async def snmp_poll(host: str, port: str, oids=(snmp.SYS_NAME,)):
+    """Полный результат опроса {oid: value} или None"""
     logging.debug(f"Get SNMP {host}:{port}")
     if not host:
-        return False
-    try:
-        async with aiosnmp.Snmp(host=host, port=port, community="UTMC") as snmp:
-            r = await snmp.get('1.3.6.1.2.1.1.5.0')
-            return True
-    except Exception as e:
-        logging.debug(f'Controller {host}:{port} unawail')
-        return False
+        return None
+    return await snmp_poller.poll(host, port, oids)
+
+
+async def snmp_get(host: str, port: str, oids=(snmp.SYS_NAME,)) -> bool:
+    return await snmp_poll(host, port, oids) is not None
 
 async def http_get(url: str, timeout: int = 2) -> bool:
     logging.debug(f"Get http {url}")
-    try:
-        async with checker_aiosession.get(url, timeout=timeout, ssl=False) as resp:
-            status = resp.status
-    except Exception as e:
-        return False
-    else:
-        if status not in range(200, 300):
-            return False
-    return True
-
+    return (await http_prober.probe(url, timeout)).ok
 
 CHECKERS = {
     'ping': ping_checker,
@@ -138,5 +318,6 @@ CHECKERS = {
     'http': http_checker,
     'snmp': snmp_checker,
     'snmp_get': snmp_get,
+    'snmp_poll': snmp_poll,
     'http_get': http_get
 }
@@ -0,0 +1,87 @@
+import time
+
+# лимиты одновременных проверок по типу проверки (ключ в checkers.CHECKERS) по умолчанию
+LIMITS = {
+    'ping': 500,
+    'http': 200,
+    'snmp': 200,
+    'service': 20,  # пачки systemctl по общему ssh ControlMaster на хост, см. ssh.ServiceMux
+}
+
+
+class TokenBucket(object):
+    """Бюджет rate запусков в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait(self) -> float:
+        """:return: через сколько секунд появится токен, 0 - есть сейчас"""
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+        return (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Governor(object):
+    """
+    Ограничение одновременных проверок: лимит на тип проверки и общий лимит на все.
+    Необязательные бюджеты rates (тип -> проверок в секунду) и rate (на все проверки)
+    ограничивают частоту запусков. Слот занимается без ожидания: если его нет, вызывающий
+    получает задержку повтора и освобождает воркер планировщика, так что насыщенный тип
+    проверок не задерживает остальные.
+    """
+
+    def __init__(self, total: int = 1000, limits: dict = None, rates: dict = None, rate: float = None,
+                 retry: float = 1):
+        self.total = total
+        self.limits = {**LIMITS, **(limits or {})}
+        self.buckets = {kind: TokenBucket(r) for kind, r in (rates or {}).items()}
+        self.bucket = TokenBucket(rate) if rate else None
+        self.retry = retry  # через сколько секунд повторить, если свободного слота нет
+        self.metrics = {'running': 0, 'deferred': 0, 'skipped': 0}
+        self.kinds = {}  # тип -> {'running', 'started', 'deferred', 'skipped', 'throttled'}
+
+    def _kind(self, kind: str) -> dict:
+        metrics = self.kinds.get(kind)
+        if metrics is None:
+            metrics = self.kinds[kind] = {'running': 0, 'started': 0, 'deferred': 0, 'skipped': 0, 'throttled': 0}
+        return metrics
+
+    def acquire(self, kind: str) -> float:
+        """
+        Занять слот для проверки типа kind, не дожидаясь освобождения слотов и токенов бюджета.
+        :return: 0, если слот занят; иначе через сколько секунд повторить попытку
+        """
+        metrics = self._kind(kind)
+        buckets = [bucket for bucket in (self.buckets.get(kind), self.bucket) if bucket is not None]
+        delay = max([bucket.wait() for bucket in buckets], default=0)
+        if delay:
+            metrics['throttled'] += 1
+            return delay
+        limit = self.limits.get(kind)
+        if self.metrics['running'] >= self.total or limit is not None and metrics['running'] >= limit:
+            metrics['deferred'] += 1
+            self.metrics['deferred'] += 1
+            return self.retry
+        for bucket in buckets:
+            bucket.take()
+        metrics['started'] += 1
+        metrics['running'] += 1
+        self.metrics['running'] += 1
+        return 0
+
+    def skip(self, kind: str):
+        """Учесть проверку, так и не получившую слот за свой интервал"""
+        self._kind(kind)['skipped'] += 1
+        self.metrics['skipped'] += 1
+
+    def release(self, kind: str):
+        self.kinds[kind]['running'] -= 1
+        self.metrics['running'] -= 1
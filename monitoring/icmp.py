@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import struct
+import time
+
+ECHO_REQUEST = 8
+ECHO_REPLY = 0
+
+# стратегии попыток ping
+ALL = 'all'  # все попытки последовательно
+FIRST = 'first'  # последовательно до первого ответа
+PARALLEL = 'parallel'  # попытки стартуют с шагом stagger, первый ответ отменяет остальные
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\0'
+    s = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    return ~s & 0xffff
+
+
+class PingResult:
+    def __init__(self, host: str):
+        self.host = host
+        self.rtts = []  # секунды, None для потерянных
+
+    @property
+    def sent(self) -> int:
+        return len(self.rtts)
+
+    @property
+    def received(self) -> int:
+        return sum(1 for rtt in self.rtts if rtt is not None)
+
+    @property
+    def alive(self) -> bool:
+        """Хотя бы одна из попыток успешна"""
+        return self.received > 0
+
+    @property
+    def loss(self) -> float:
+        return 1 - self.received / self.sent if self.sent else 1.0
+
+    @property
+    def rtt(self):
+        rtts = [rtt for rtt in self.rtts if rtt is not None]
+        return sum(rtts) / len(rtts) if rtts else None
+
+    def __repr__(self):
+        return f'PingResult({self.host}, sent={self.sent}, received={self.received}, rtt={self.rtt})'
+
+
+class Pinger:
+    """
+    ICMP echo через один общий сокет на процесс: raw (нужен CAP_NET_RAW) или
+    непривилегированный datagram (net.ipv4.ping_group_range). Ответы разбираются по
+    identifier/sequence. Если сокеты недоступны - по процессу `ping -c 1` на попытку.
+    """
+
+    def __init__(self, payload_size: int = 16):
+        self.payload = b'Q' * payload_size
+        self.mode = None  # 'raw', 'dgram' или 'subprocess'
+        self._sock = None
+        self._loop = None
+        self._ident = os.getpid() & 0xffff
+        self._seq = itertools.count()
+        self._pending = {}  # seq -> (ip, future)
+
+    def _open(self):
+        loop = asyncio.get_event_loop()
+        if self.mode is not None:
+            if self._loop is loop:
+                return
+            self.close()  # сокет привязан к другому (уже закрытому) циклу
+        self._loop = loop
+        for mode, kind in (('raw', socket.SOCK_RAW), ('dgram', socket.SOCK_DGRAM)):
+            try:
+                sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            if mode == 'dgram':
+                sock.bind(('', 0))
+                self._ident = sock.getsockname()[1] & 0xffff  # ядро подменяет identifier на номер порта
+            self._sock = sock
+            self.mode = mode
+            loop.add_reader(sock.fileno(), self._on_readable)
+            break
+        else:
+            self.mode = 'subprocess'
+        logging.debug(f'ICMP pinger mode: {self.mode}')
+
+    def close(self):
+        if self._sock is not None:
+            if not self._loop.is_closed():
+                self._loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+        self.mode = None
+        for _, future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, (ip, _) = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logging.debug(f'ICMP receive error {repr(e)}')
+                return
+            received = time.monotonic()
+            if self.mode == 'raw':
+                data = data[(data[0] & 0x0f) * 4:]  # IP-заголовок
+            if len(data) < 8:
+                continue
+            kind, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+            if kind != ECHO_REPLY or ident != self._ident:
+                continue
+            pending = self._pending.get(seq)
+            if pending is not None and pending[0] == ip and not pending[1].done():
+                pending[1].set_result(received)
+
+    async def _resolve(self, host: str) -> str:
+        infos = await asyncio.get_event_loop().getaddrinfo(host, None, family=socket.AF_INET)
+        return infos[0][4][0]
+
+    async def _subprocess_echo(self, host: str, timeout: float):
+        started = time.monotonic()
+        with open(os.devnull, 'w') as devnull:
+            pr = await asyncio.create_subprocess_shell(
+                f'ping -c 1 -W {str(timeout)} {host}',
+                stdout=devnull,
+                stderr=devnull,
+            )
+        code = await pr.wait()
+        return time.monotonic() - started if code == 0 else None
+
+    async def echo(self, host: str, ip: str, timeout: float):
+        """Одна попытка: RTT в секундах или None"""
+        self._open()
+        if self.mode == 'subprocess':
+            return await self._subprocess_echo(host, timeout)
+
+        seq = next(self._seq) & 0xffff
+        header = struct.pack('!BBHHH', ECHO_REQUEST, 0, 0, self._ident, seq)
+        packet = struct.pack('!BBHHH', ECHO_REQUEST, 0, checksum(header + self.payload), self._ident, seq) \
+            + self.payload
+        future = self._loop.create_future()
+        self._pending[seq] = (ip, future)
+        try:
+            started = time.monotonic()
+            try:
+                self._sock.sendto(packet, (ip, 0))
+            except OSError as e:  # в т.ч. переполненный буфер - считаем потерей
+                logging.debug(f'ICMP send to {host} failed {repr(e)}')
+                return None
+            try:
+                received = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                return None
+            return received - started
+        finally:
+            self._pending.pop(seq, None)
+
+    async def ping(self, host: str, timeout: float = 1, count: int = 1,
+                   strategy: str = ALL, stagger: float = 0.2) -> PingResult:
+        """
+        До count попыток, каждая как `ping -c 1 -W timeout`.
+        :param strategy: ALL, FIRST или PARALLEL
+        :param stagger: задержка между стартами попыток для PARALLEL, секунды
+        """
+        result = PingResult(host)
+        self._open()
+        try:
+            ip = host if self.mode == 'subprocess' else await self._resolve(host)
+        except OSError:
+            result.rtts = [None] * count
+            return result
+        if strategy == PARALLEL:
+            await self._parallel(result, ip, timeout, count, stagger)
+            return result
+        for _ in range(count):
+            rtt = await self.echo(host, ip, timeout)
+            result.rtts.append(rtt)
+            if rtt is not None and strategy == FIRST:
+                break
+        return result
+
+    async def _parallel(self, result: PingResult, ip: str, timeout: float, count: int, stagger: float):
+        async def attempt(i):
+            await asyncio.sleep(i * stagger)
+            return await self.echo(result.host, ip, timeout)
+
+        tasks = [asyncio.ensure_future(attempt(i)) for i in range(count)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                rtt = await next_done
+                result.rtts.append(rtt)
+                if rtt is not None:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ping_many(self, hosts, timeout: float = 1, count: int = 1,
+                        strategy: str = ALL, stagger: float = 0.2) -> dict:
+        """Опрос многих хостов одновременно через общий сокет: {host: PingResult}"""
+        hosts = list(dict.fromkeys(hosts))
+        results = await asyncio.gather(*(self.ping(host, timeout, count, strategy, stagger) for host in hosts))
+        return dict(zip(hosts, results))
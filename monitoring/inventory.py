@@ -0,0 +1,54 @@
+def content_hash(record: dict) -> int:
+    """
+    Хэш содержимого записи SB (разобранный JSON), стабилен в пределах процесса.
+    Порядок ключей учитывается: перестановка полей в SB даст лишний пересчёт конфига, но не перезапуск.
+    """
+    return hash(repr(record))
+
+
+class Inventory(object):
+    """
+    Последняя известная выгрузка устройств одного типа из SB: id -> хэш записи.
+    diff() сравнивает новую выгрузку по множествам id и хэшам, не пересобирая конфиги
+    неизменившихся устройств. Хэш запоминается только после применения изменения, поэтому
+    ошибка при применении не теряет его.
+    """
+
+    def __init__(self):
+        self.hashes = {}  # id -> content_hash
+        self.etag = None  # ETag последней полной выгрузки
+        self.since = None  # начало последней успешной выгрузки, для updatedSince
+        self.metrics = {'fetches': 0, 'not_modified': 0, 'changed': 0, 'removed': 0}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def diff(self, data: list, full: bool = True) -> (list, set):
+        """
+        Ничего не запоминает: применённые изменения подтверждаются через applied() и forget(),
+        неприменённые вернутся в следующем diff().
+        :param data: записи SB с полем id
+        :param full: полная выгрузка; для частичной (updatedSince) удалений не бывает
+        :return: (новые и изменившиеся записи, id удалённых)
+        """
+        hashes = self.hashes
+        fresh = {d['id']: d for d in data}
+        changed = [d for i, d in fresh.items() if hashes.get(i) != content_hash(d)]
+        removed = hashes.keys() - fresh.keys() if full else set()
+        self.metrics['fetches'] += 1
+        self.metrics['changed'] += len(changed)
+        self.metrics['removed'] += len(removed)
+        return changed, removed
+
+    def applied(self, record: dict):
+        """Новая или изменившаяся запись из diff() применена"""
+        self.hashes[record['id']] = content_hash(record)
+
+    def forget(self, id_):
+        """Удаление из diff() применено"""
+        self.hashes.pop(id_, None)
+
+    def invalidate(self):
+        """Не всё из выгрузки применено: следующая выгрузка - полная и без If-None-Match"""
+        self.etag = None
+        self.since = None
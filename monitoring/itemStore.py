@@ -1,21 +1,53 @@
-import threading
+import asyncio
 
 
 class ItemStore(object):
-    def __init__(self):
-        self.lock = threading.Lock()
+    """
+    Очередь событий внутри одного цикла событий asyncio: производители и потребитель работают
+    в одном потоке, поэтому блокировки не нужны, а get_all забирает список целиком без копирования.
+    При заполнении до maxlen новые элементы отбрасываются и считаются в metrics['overflow'].
+    """
+
+    def __init__(self, maxlen: int = None):
+        self.maxlen = maxlen
         self.items = []
+        self.metrics = {'added': 0, 'overflow': 0}
+        self._waiter = None  # (порог, future) единственного потребителя
+
+    def __len__(self):
+        return len(self.items)
 
     def add(self, item):
-        with self.lock:
-            self.items.append(item)
+        if self.maxlen is not None and len(self.items) >= self.maxlen:
+            self.metrics['overflow'] += 1
+            return
+        self.items.append(item)
+        self.metrics['added'] += 1
+        waiter = self._waiter
+        if waiter is not None and len(self.items) >= waiter[0] and not waiter[1].done():
+            waiter[1].set_result(None)
 
-    def get_all(self):
-        with self.lock:
-            items, self.items = self.items, []
+    def get_all(self) -> list:
+        items, self.items = self.items, []
         return items
 
-    def read_all(self):
-        with self.lock:
-            items = self.items
-            return items
+    def read_all(self) -> tuple:
+        """Снимок очереди без извлечения; изменить очередь через него нельзя"""
+        return tuple(self.items)
+
+    async def wait(self, threshold: int = 1, timeout: float = None) -> bool:
+        """
+        Дождаться, пока в очереди будет не меньше threshold элементов.
+        :return: False, если за timeout секунд порог не достигнут
+        """
+        if len(self.items) >= threshold:
+            return True
+        future = asyncio.get_event_loop().create_future()
+        self._waiter = (threshold, future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiter = None
@@ -2,7 +2,9 @@ import argparse
 import asyncio
 import datetime
 import json
+import random
 import signal
+import time
 import aiohttp
 import redis
 import logging.config
@@ -12,11 +14,14 @@ import yaml
 import checkers
 import errors
 from typing import AnyStr, Union
-from checkers import checker_aiosession
+from governor import Governor
+from inventory import Inventory
 from itemStore import ItemStore
-
-# Events poster
-messages = ItemStore()
+from notifier import Notifier
+from outbox import Outbox
+from scheduler import Scheduler, backoff
+from statusWriter import StatusWriter
+from topology import Topology, parse_key
 
 
 def validate_config(config: dict):
@@ -42,24 +47,44 @@ def validate_config(config: dict):
         return
 
 
-async def async_get_from_sb(session: aiohttp.ClientSession, config: dict) -> list or None:
+async def async_get_inventory(session: aiohttp.ClientSession, config: dict, inventory: Inventory,
+                              full: bool = True) -> list or None:
+    """
+    Выгрузка устройств с условным запросом: If-None-Match по ETag прошлой полной выгрузки,
+    для частичной - только изменившиеся с inventory.since (имя параметра в config['updated_since']).
+    :return: записи или None, если выгрузка не изменилась или недоступна
+    """
     params = {'access_token': SB_LOGIN_TOKEN} if SB_LOGIN_TOKEN else {}
-
+    headers = {}
+    if not full:
+        params[config['updated_since']] = inventory.since
+    elif inventory.etag:
+        headers['If-None-Match'] = inventory.etag
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat()
     try:
         async with session.get(
                 cfg['datasources']['sb'] + config['url'],
                 timeout=float(config['timeout']),
                 params=params,
+                headers=headers,
         ) as resp:
+            if resp.status == 304:
+                inventory.metrics['not_modified'] += 1
+                inventory.since = started
+                return None
             r = await resp.json()
-
-    except aiohttp.ClientConnectionError or aiohttp.ServerTimeoutError:
+            etag = resp.headers.get('ETag')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.error(f'{config.get("type")} inventory fetch error {repr(e)}')
         return None
-    else:
-        return r
+    if full:
+        inventory.etag = etag
+    inventory.since = started
+    return r
 
 
-async def async_post_to_sb(session: aiohttp.ClientSession, url: str, data: dict) -> None:
+async def async_post_to_sb(session: aiohttp.ClientSession, url: str, data: dict) -> bool:
+    """:return: True, если SB принял запрос"""
     params = {'access_token': SB_LOGIN_TOKEN} if SB_LOGIN_TOKEN else {}
     try:
         async with session.post(
@@ -69,8 +94,13 @@ async def async_post_to_sb(session: aiohttp.ClientSession, url: str, data: dict)
                 json=data
         ) as resp:
             await resp.json()
+            if resp.status >= 400:
+                log.error(f'SB post error, status {resp.status}')
+                return False
+            return True
     except Exception as e:
         log.error(f'SB post error {repr(e)}')
+        return False
 
 
 def sb_login() -> Union[AnyStr, None]:
@@ -92,7 +122,7 @@ def sb_login() -> Union[AnyStr, None]:
     return resp['id']
 
 
-async def check(config: dict) -> (bool, str):
+async def check(config: dict) -> checkers.CheckResult:
     msg = ''
     chs = config.get('checks', [])
     for ch in chs:
@@ -100,13 +130,23 @@ async def check(config: dict) -> (bool, str):
             checker_func = checkers.CHECKERS[ch]
         except KeyError:
             log.error(f'{config} - check error: No such check functions')
-            return False, ''
-        res, msg = await checker_func(config)
-        return res, msg
-    return True, msg
+            return checkers.CheckResult(False, '')
+        result = await checker_func(config)
+        return result if isinstance(result, checkers.CheckResult) else checkers.CheckResult(*result)
+    return checkers.CheckResult(True, msg)
 
 
-async def notify(msg: str, layer: str = None, coords: object = None, header: str = ''):
+def controller_status(result: checkers.CheckResult) -> dict:
+    """Статус контроллера для redis - ровно то, что наблюдала проверка"""
+    return {
+        "controller": result.components.get('controller', result.ok),
+        "spot": result.components.get('spot_http', False),
+    }
+
+
+def notify(msg: str, layer: str = None, coords: object = None, header: str = '', label: str = None,
+           kind: str = None):
+    """Поставить уведомление SB в очередь агрегатора; label и kind - для сводных уведомлений"""
     try:
         notifications = cfg.get('notifications')
         if 'sb' in notifications:
@@ -130,145 +170,202 @@ async def notify(msg: str, layer: str = None, coords: object = None, header: str
                 'status': 'active'
             }
 
-            await async_post_to_sb(
-                api_aiosession,
-                notifications['sb'].get('notifications_url', '/api/notifications'),
-                data
-            )
-            log.debug(f'Notification created: {msg}')
+            notifier.add(data, label=label, kind=kind)
     except Exception as e:
         log.error('Unknown error in notifications ' + repr(e))
 
 
-async def monitoring(config: dict):
-    fails = 0
-    max_fails = config.get('failed_counter', 5)
-    interval = config.get('interval', 120)
-    timeout_interval = config.get('timeout_interval', 10)
-    try:
-        device_id = int(config['id'])
-    except ValueError:
-        device_id = None
+# отметка в заголовке уведомления: с именем объекта и без
+HEADER_MARKS = {'UP': ('\u2705', '\u2705'), 'DOWN': ('\u274c', ' \u274c')}
 
-    log.info(f'Monitoring for {config["name"]} started. MF: {max_fails} INT: {interval} TO_INT: {timeout_interval}')
-    while True:
+
+class Monitor(object):
+    """Состояние проверок одного устройства; step() - один цикл проверки, запускается планировщиком"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.fails = 0
+        self.max_fails = config.get('failed_counter', 5)
+        self.interval = config.get('interval', 120)
+        self.timeout_interval = config.get('timeout_interval', 10)
+        self.down_interval = config.get('down_interval', 600)  # потолок интервала для подтверждённого DOWN
+        try:
+            self.device_id = int(config['id'])
+        except ValueError:
+            self.device_id = None
+        log.info(f'Monitoring for {config["name"]} started. '
+                 f'MF: {self.max_fails} INT: {self.interval} TO_INT: {self.timeout_interval} '
+                 f'DOWN_INT: {self.down_interval}')
+        self.key = (config['type'], config['id'])  # ключ в планировщике и топологии
+        self.kind = (config.get('checks') or [None])[0]  # тип проверки для лимитов governor
+        self.deferred = None  # с какого момента проверка ждёт свободного слота
+        self.suppressed = False  # DOWN отложен из-за сбоя предка: UP не нужен, DOWN уйдёт, если сбой переживёт предка
+        self._headers = {}
+        self._messages = {}
+
+    def header(self, kind: str) -> str:
+        """Заголовок уведомления UP/DOWN; не меняется за время жизни монитора, поэтому собирается один раз"""
+        header = self._headers.get(kind)
+        if header is None:
+            cfg_object_name = self.config.get('object_name')
+            mark, bare_mark = HEADER_MARKS[kind]
+            header = self._headers[kind] = json.dumps({
+                'trMessage': 'Monitoring -- {{tr_config_name}} -- {{config_id}} ' +
+                             ('-- {{config_obj_name}} ' + mark if cfg_object_name is not None and cfg_object_name != '' else bare_mark),
+                'trParams': {
+                    'tr_config_name': self.config['name'],
+                    'config_id': self.config['id'],
+                    'config_obj_name': cfg_object_name
+                }
+            })
+        return header
+
+    def message(self, text: str) -> str:
+        message = self._messages.get(text)
+        if message is None:
+            message = self._messages[text] = json.dumps({
+                'trMessage': text,
+                'trParams': {'tr_config_name': self.config['name']}
+            })
+        return message
+
+    def fail_delay(self) -> float:
+        """
+        Пока отказ не подтверждён (fails < max_fails) - частые повторы через timeout_interval,
+        после - удвоение интервала с каждой неудачей до down_interval
+        """
+        return backoff(self.timeout_interval, self.fails - self.max_fails, max(self.down_interval, self.timeout_interval))
+
+    async def step(self) -> float:
+        """:return: задержка до следующей проверки, секунды"""
+        config = self.config
         try:
             cfg_name = config['name']
             cfg_type = config['type']
             cfg_id = config['id']
-            cfg_object_name = config['object_name'] if 'object_name' in config else None
-            res, msg = await check(config)
+            blocker = topology.blocked_by(self.key)
+            if blocker is not None:
+                topology.metrics['suppressed_checks'] += 1
+                log.debug(f'{cfg_name} - check paused, {blocker} is down')
+                return max(self.interval, topology.paused_interval)
+            retry = governor.acquire(self.kind)
+            if retry:
+                now = time.monotonic()
+                if self.deferred is None:
+                    self.deferred = now
+                if now + retry - self.deferred < self.interval:
+                    return retry  # повторить позже, не занимая воркер ожиданием слота
+                self.deferred = None
+                governor.skip(self.kind)
+                log.debug(f'{cfg_name} - skipped, no free check slot in {self.interval} s')
+                return self.interval
+            self.deferred = None
+            try:
+                result = await check(config)
+            finally:
+                governor.release(self.kind)
+            res, msg = result
             if res:
                 if cfg_type == 'controllers':
-                    data = {
-                        "controller": (await checkers.snmp_get(config.get('host'), config.get('port') )),
-                        "spot": (await checkers.http_get(f"http://{config.get('spot_ip')}:{config.get('spot_port')}/stats?count=1")) if config.get('has_spot') else False
-                    }
-                    redis.hset(f'monitoring:{cfg_type}', cfg_id, json.dumps(data))
+                    status.set(f'monitoring:{cfg_type}', cfg_id, json.dumps(controller_status(result)))
                 else:
-                    redis.hset(f'monitoring:{cfg_type}', cfg_id, 1)
-                if fails:
+                    status.set(f'monitoring:{cfg_type}', cfg_id, 1)
+                if self.fails and self.suppressed:
+                    log.info(f'{cfg_name} - restored, notification suppressed')
+                elif self.fails:
                     log.info(f'{cfg_name} - restored')
-
-                    message_text = {
-                        'trMessage': '{{tr_config_name}} performance restored',
-                        'trParams': {'tr_config_name': cfg_name}
-                    }
-
-                    header_text = {
-                        'trMessage': 'Monitoring -- {{tr_config_name}} -- {{config_id}} ' +
-                                     ('-- {{config_obj_name}} \u2705' if cfg_object_name is not None and cfg_object_name != '' else '\u2705'),
-                        'trParams': {
-                            'tr_config_name': cfg_name,
-                            'config_id': cfg_id,
-                            'config_obj_name': cfg_object_name
-                        }
-                    }
-
-                    name = json.dumps(message_text)
-                    header = json.dumps(header_text)
-                    await notify(name,
-                                 layer=config.get('layer'),
-                                 coords=config.get('location'),
-                                 header=header
-                                 )
+                    notify(self.message('{{tr_config_name}} performance restored'),
+                           layer=config.get('layer'),
+                           coords=config.get('location'),
+                           header=self.header('UP'),
+                           label=f'{cfg_name} {cfg_id}',
+                           kind='UP'
+                           )
+                if self.fails:
                     ts = datetime.datetime.now()
                     messages.add({
                         'timestamp': ts.isoformat(),
                         'event': f"[UP] -- {cfg_name} -- {cfg_id}  -- работоспособность восстановлена",
                         'sourceType': cfg_type,
-                        'sourceId': device_id
+                        'sourceId': self.device_id
                     })
-                fails = 0
-                await asyncio.sleep(interval)
+                self.fails = 0
+                self.suppressed = False
+                if topology.update(self.key, 0, False):
+                    for child in topology.descendants(self.key):  # проверить потомков, не дожидаясь паузы
+                        scheduler.reschedule(child, random.uniform(0, scheduler.spread))
+                return self.interval
             elif msg:
                 if cfg_type == "controllers":
-                    data = {
-                        "controller": False,
-                        "spot": False
-                    }
-                    redis.hset(f'monitoring:{cfg_type}', cfg_id, json.dumps(data))
+                    status.set(f'monitoring:{cfg_type}', cfg_id, json.dumps(controller_status(result)))
                 else:
-                    redis.hset(f'monitoring:{cfg_type}', cfg_id, 0)
-                fails += 1
+                    status.set(f'monitoring:{cfg_type}', cfg_id, 0)
+                self.fails += 1
                 log.debug(f'{cfg_name} - {msg}')
 
-                if fails == max_fails:
+                if self.fails == self.max_fails:
                     log.info(f'{cfg_name} - maximum fail limit reached')
-                    message_text = {
-                        'trMessage': '{{tr_config_name}} -- ' + f'{msg}',
-                        'trParams': {'tr_config_name': cfg_name}
-                    }
-
-                    header_text = {
-                        'trMessage': 'Monitoring -- {{tr_config_name}} -- {{config_id}} ' +
-                                     ('-- {{config_obj_name}} \u274c' if cfg_object_name is not None and cfg_object_name != '' else ' \u274c'),
-                        'trParams': {
-                            'tr_config_name': cfg_name,
-                            'config_id': cfg_id,
-                            'config_obj_name': cfg_object_name
-                        }
-                    }
-
-                    name = json.dumps(message_text)
-                    header = json.dumps(header_text)
-
-                    await notify(
-                        name,
-                        layer=config.get('layer'),
-                        coords=config.get('location'),
-                        header=header
-                    )
                     ts = datetime.datetime.now()
                     messages.add({
                         'timestamp': ts.isoformat(),
                         'event': f"[DOWN] -- {cfg_name} -- {cfg_id} -- {msg}",
                         'sourceType': cfg_type,
-                        'sourceId': device_id
+                        'sourceId': self.device_id
                     })
-                await asyncio.sleep(timeout_interval)
+                if self.fails == self.max_fails or self.suppressed:
+                    suspect = topology.suspect(self.key)
+                    if suspect is not None:
+                        if not self.suppressed:
+                            topology.metrics['suppressed_alerts'] += 1
+                            log.info(f'{cfg_name} - DOWN notification deferred: {suspect} is failing')
+                        self.suppressed = True  # отправить DOWN, когда предок восстановится, если сбой останется
+                    else:
+                        if self.suppressed:
+                            log.info(f'{cfg_name} - still down after parent recovery, sending deferred DOWN')
+                        self.suppressed = False
+                        notify(
+                            self.message('{{tr_config_name}} -- ' + f'{msg}'),
+                            layer=config.get('layer'),
+                            coords=config.get('location'),
+                            header=self.header('DOWN'),
+                            label=f'{cfg_name} {cfg_id}',
+                            kind='DOWN'
+                        )
+                topology.update(self.key, self.fails, self.fails >= self.max_fails)
+                return self.fail_delay()
             else:
                 log.error('Monitoring check error')
-        except asyncio.CancelledError as e:
-            log.info("Monitoring sb canceled")
-            return True
+                return self.timeout_interval
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             log.error('Monitoring error {}'.format(repr(e)))
-            await asyncio.sleep(timeout_interval)
+            return self.timeout_interval
 
 
 async def post_messages():
-    buffer = []
+    """
+    Отправка событий в SB через outbox: порциями не больше batch событий и batch_bytes байт,
+    при ошибке - повтор с экспоненциальной задержкой до backoff_max секунд.
+    Новые события отправляются раз в interval секунд или сразу по накоплении flush_size.
+    """
+    events_conf = cfg['notifications']['events']
+    interval = events_conf['interval']
+    flush_size = events_conf.get('flush_size', 100)
+    batch = events_conf.get('batch', 500)
+    batch_bytes = events_conf.get('batch_bytes', 1024 * 1024)
+    backoff_max = events_conf.get('backoff_max', 300)
+    delay = interval
     while True:
         log.debug("Post messages")
-        data = messages.get_all()
-        buffer += data
-        if buffer:
-
+        outbox.append(messages.get_all())
+        sent = True
+        while len(outbox):
+            items, position = outbox.peek(batch, batch_bytes)
             try:
-                async with api_aiosession.post(cfg['datasources']['sb'] + cfg['notifications']['events']['url'],
-                                               json=buffer,
-                                               timeout=float(cfg['notifications']['events']['timeout'])) as resp:
+                async with api_aiosession.post(cfg['datasources']['sb'] + events_conf['url'],
+                                               json=items,
+                                               timeout=float(events_conf['timeout'])) as resp:
                     status_code = resp.status
                     log.debug(f"aiosession post_code {status_code}")
             except aiohttp.ServerTimeoutError:
@@ -276,10 +373,22 @@ async def post_messages():
             except Exception as e:
                 log.error('Posting error {}'.format(repr(e)))
             else:
-                log.debug(f'Posted events ({len(data)} items) to server')
-                buffer = []
-
-        await asyncio.sleep(cfg['notifications']['events']['interval'])  # sleep 60 seconds
+                if status_code < 500:  # 4xx повтором не исправить - порция отбрасывается
+                    if status_code >= 400:
+                        log.error(f'SB rejected {len(items)} events with code {status_code}')
+                    outbox.ack(position)
+                    log.debug(f'Posted events ({len(items)} items) to server, {len(outbox)} left')
+                    continue
+            sent = False
+            break
+
+        if sent:
+            delay = interval
+            await messages.wait(flush_size, interval)
+        else:
+            delay = min(delay * 2, backoff_max)
+            log.debug(f'Events not posted, {len(outbox)} in outbox, retry in {delay} s')
+            await asyncio.sleep(delay)
 
 
 async def prepare_data_for_updater(orig_device: dict, d_type: str, d: dict):
@@ -303,6 +412,7 @@ async def prepare_data_for_updater(orig_device: dict, d_type: str, d: dict):
                         f"https://{d['ip']}:{d.get('port')}/" if ip else f"https://{d['controllerIp']}:{d['controllerPort']}/")
         c['url'] = web_url
         c['location'] = d.get('location', None)
+        c['parent_host'] = d.get('controllerIp')  # проверяется через контроллер - зависит от него
     return c
 
 
@@ -315,30 +425,44 @@ async def device_updater(device: dict):
         monitors['devices'][d_type] = {}
 
     log.debug(f'{d_type}: Device updater started')
+    inventory = Inventory()
+    depends_on = [parse_key(key) for key in device.get('depends_on', [])]
+    full_refresh = device.get('full_refresh', 10)  # каждая N-я выгрузка полная, если включён updatedSince
+    refreshes = 0
     while True:
         try:
-            data = await async_get_from_sb(get_from_sb_session, device)
-            inactive_monitors = list(monitors['devices'][d_type].keys())
-            for d in data:
-                c = await prepare_data_for_updater(device, d_type, d)
-                if d['id'] not in monitors['devices'][d_type]:
-                    m = asyncio.ensure_future(monitoring(c))
-                    monitors['devices'][d_type][d['id']] = dict(info=c, task=m)
-
-                elif monitors['devices'][d_type][d['id']]['info'] != c:
-                    log.info(f'Device {d_type} id {d["id"]} changed, restarting monitoring')
-                    monitors['devices'][d_type][d['id']]['task'].cancel()
-                    m = asyncio.ensure_future(monitoring(c))
-                    monitors['devices'][d_type][d['id']] = dict(info=c, task=m)
-                    inactive_monitors.remove(d['id'])
-
-                if d['id'] in inactive_monitors:
-                    inactive_monitors.remove(d['id'])
-
-            for m_id in inactive_monitors:
-                monitors['devices'][d_type][m_id]['task'].cancel()
-                monitors['devices'][d_type].pop(m_id, None)
-                log.info(f'Monitoring for {d_type} id {m_id} stopped')
+            full = not device.get('updated_since') or inventory.since is None or refreshes % full_refresh == 0
+            data = await async_get_inventory(get_from_sb_session, device, inventory, full)
+            refreshes += 1
+            if data is not None:
+                changed, removed = inventory.diff(data, full)
+                devices = monitors['devices'][d_type]
+                failed = 0
+                for d in changed:
+                    try:
+                        c = await prepare_data_for_updater(device, d_type, d)
+                        current = devices.get(d['id'])
+                        if current is None or current['info'] != c:
+                            if current is not None:
+                                log.info(f'Device {d_type} id {d["id"]} changed, restarting monitoring')
+                            scheduler.add((d_type, d['id']), Monitor(c).step)
+                            topology.add((d_type, d['id']), depends_on, host=c.get('host'),
+                                         parent_host=c.get('parent_host'))
+                            devices[d['id']] = dict(info=c)
+                    except Exception as e:
+                        failed += 1
+                        log.error(f'Device {d_type} id {d.get("id")} update error {repr(e)}')
+                        continue
+                    inventory.applied(d)
+
+                for m_id in removed:
+                    scheduler.remove((d_type, m_id))
+                    topology.remove((d_type, m_id))
+                    devices.pop(m_id, None)
+                    inventory.forget(m_id)
+                    log.info(f'Monitoring for {d_type} id {m_id} stopped')
+                if failed:
+                    inventory.invalidate()  # повторить неприменённое со следующей полной выгрузкой
 
         except Exception as e:
             log.error('Unknown error in device updater')
@@ -350,12 +474,23 @@ async def device_updater(device: dict):
 async def heartbeat():
     while True:
         redis.set('monitoring:heartbeat', 1, 20)
-        log.debug("Heartbeat")
+        log.debug(f"Heartbeat. Status queue: {status.depth}, "
+                  f"last flush: {status.metrics['last_flush_latency'] * 1000:.1f} ms, "
+                  f"max flush: {status.metrics['max_flush_latency'] * 1000:.1f} ms. "
+                  f"Checks: {len(scheduler)}, due: {scheduler.queued}, lag: {scheduler.metrics['lag']:.1f} s, "
+                  f"running: {governor.metrics['running']}, deferred: {governor.metrics['deferred']}, "
+                  f"skipped: {governor.metrics['skipped']}. "
+                  f"Events queue: {len(messages)}, overflow: {messages.metrics['overflow']}. "
+                  f"Outbox: {len(outbox)} events, {outbox.size} bytes, dropped: {outbox.metrics['dropped']}. "
+                  f"Down: {len(topology.down)}, paused checks: {topology.metrics['suppressed_checks']}, "
+                  f"suppressed alerts: {topology.metrics['suppressed_alerts']}")
         await asyncio.sleep(10)
 
 
 async def shutdown(_sig, loop):
-    await checker_aiosession.close()
+    await notifier.flush()  # не терять уведомления, ещё собираемые в окне
+    await checkers.http_prober.close()
+    await checkers.service_mux.close()
     await get_from_sb_session.close()
     await api_aiosession.close()
     tasks = [t for t in asyncio.Task.all_tasks() if t is not
@@ -396,9 +531,45 @@ if __name__ == '__main__':
     redis_conf = cfg.get('redis', {'host': '127.0.0.1', 'port': 6379})
 
     redis = redis.Redis(host=redis_conf.get('host', '127.0.0.1'), port=redis_conf.get('port', 6379), db=0)
+    status = StatusWriter(redis, interval=redis_conf.get('flush_interval', 1), max_batch=redis_conf.get('flush_batch', 1000))
     get_from_sb_session = aiohttp.ClientSession()
     api_aiosession = aiohttp.ClientSession()
+    sb_notifications = cfg.get('notifications', {}).get('sb', {})
+    notifier = Notifier(
+        lambda url, data: async_post_to_sb(api_aiosession, url, data),
+        sb_notifications.get('notifications_url', '/api/notifications'),
+        window=sb_notifications.get('window', 2),
+        bulk_url=sb_notifications.get('bulk_url'),
+        batch=sb_notifications.get('batch', 100),
+        summary_threshold=sb_notifications.get('summary_threshold', 10),
+        rate=sb_notifications.get('rate', 5),
+    )
+    events_conf = cfg.get('notifications', {}).get('events', {})
+    messages = ItemStore(maxlen=events_conf.get('queue_maxlen', 100000))
+    outbox_conf = events_conf.get('outbox', {})
+    outbox = Outbox(
+        outbox_conf.get('path', 'outbox'),
+        max_bytes=outbox_conf.get('max_bytes', 64 * 1024 * 1024),
+        segment_bytes=outbox_conf.get('segment_bytes', 4 * 1024 * 1024),
+        drop=outbox_conf.get('drop', 'oldest'),
+        fsync=outbox_conf.get('fsync', False),
+    )
     event_loop = asyncio.get_event_loop()
+    scheduler_conf = cfg.get('scheduler', {})
+    scheduler = Scheduler(
+        workers=scheduler_conf.get('workers', 500),
+        jitter=scheduler_conf.get('jitter', 0.1),
+        spread=scheduler_conf.get('spread', 10),
+    )
+    checkers.http_prober.configure(**cfg.get('http', {}))
+    topology = Topology(paused_interval=cfg.get('topology', {}).get('paused_interval', 600))
+    concurrency_conf = cfg.get('concurrency', {})
+    governor = Governor(
+        total=min(concurrency_conf.get('total', 1000), scheduler.workers),  # слот всегда найдёт воркер
+        limits=concurrency_conf.get('limits'),
+        rates=concurrency_conf.get('rates'),
+        rate=concurrency_conf.get('rate'),
+    )
     monitors = {
         'servers': {},
         'devices': {},
@@ -429,9 +600,13 @@ if __name__ == '__main__':
         for k, s in servers.items():
             s['type'] = 'servers'
             s['id'] = k
-            event_loop.create_task(monitoring(s))
+            scheduler.add(('servers', k), Monitor(s).step)
+            topology.add(('servers', k), [parse_key(key) for key in s.get('depends_on', [])], host=s.get('host'))
+        event_loop.create_task(scheduler.run())
         event_loop.create_task(heartbeat())
+        event_loop.create_task(status.run())
         event_loop.create_task(post_messages())
+        event_loop.create_task(notifier.run())
         event_loop.run_forever()
     finally:
         log.info("Shutdown")
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import time
+
+SUMMARY_MARKS = {'UP': '\u2705', 'DOWN': '\u274c'}
+
+
+class Notifier(object):
+    """
+    Агрегатор уведомлений SB. Уведомления копятся window секунд от первого и группируются по
+    (тип уведомления, слой, UP/DOWN). Группа уходит одним запросом на bulk_url, если SB его
+    поддерживает, иначе при summary_threshold и больше уведомлений - одним сводным со списком
+    устройств, иначе по одному. Запросов не больше rate в секунду.
+    """
+
+    def __init__(self, send, url: str, window: float = 2, bulk_url: str = None, batch: int = 100,
+                 summary_threshold: int = 10, rate: float = 5):
+        self.send = send  # async send(url, data) -> True, если SB принял уведомление
+        self.url = url
+        self.window = window
+        self.bulk_url = bulk_url
+        self.batch = batch
+        self.summary_threshold = summary_threshold
+        self.rate = rate
+        self.pending = {}  # (notificationTypeId, layer, kind) -> [(data, label)]
+        self.metrics = {'queued': 0, 'sent': 0, 'failed': 0, 'requests': 0, 'summaries': 0}
+        self._wakeup = None
+        self._next_request = 0.0
+
+    def __len__(self):
+        return sum(len(items) for items in self.pending.values())
+
+    def add(self, data: dict, label: str = None, kind: str = None):
+        """
+        :param data: уведомление SB
+        :param label: устройство для сводного уведомления
+        :param kind: 'UP' или 'DOWN'
+        """
+        self.pending.setdefault((data['notificationTypeId'], data['layer'], kind), []).append((data, label))
+        self.metrics['queued'] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _post(self, url: str, data, count: int = 1):
+        """:param count: сколько уведомлений в запросе"""
+        now = time.monotonic()
+        if now < self._next_request:
+            await asyncio.sleep(self._next_request - now)
+        self._next_request = max(now, self._next_request) + 1 / self.rate
+        self.metrics['requests'] += 1
+        try:
+            delivered = await self.send(url, data)
+        except Exception as e:
+            logging.error(f'Notifications send error {repr(e)}')
+            delivered = False
+        self.metrics['sent' if delivered else 'failed'] += count
+
+    @staticmethod
+    def summary(items: list, kind: str) -> dict:
+        data = items[0][0]
+        header = {'trMessage': 'Monitoring -- {{count}} ' + SUMMARY_MARKS.get(kind, ''),
+                  'trParams': {'count': len(items)}}
+        description = {'trMessage': '{{devices}}',
+                       'trParams': {'devices': ', '.join(str(label) for _, label in items)}}
+        return {
+            'name': json.dumps(header),
+            'description': json.dumps(description),
+            'notificationTypeId': data['notificationTypeId'],
+            'layer': data['layer'],
+            'location': None,
+            'status': 'active'
+        }
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for (_, _, kind), items in pending.items():
+            if self.bulk_url:
+                for i in range(0, len(items), self.batch):
+                    batch = [data for data, _ in items[i:i + self.batch]]
+                    await self._post(self.bulk_url, batch, len(batch))
+            elif len(items) >= self.summary_threshold:
+                self.metrics['summaries'] += 1
+                await self._post(self.url, self.summary(items, kind), len(items))
+            else:
+                for data, _ in items:
+                    await self._post(self.url, data)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            if not self.pending:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(self.window)  # собрать уведомления, пришедшие вместе с первым
+            await self.flush()
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+
+MiB = 1024 * 1024
+
+
+class Outbox(object):
+    """
+    Очередь событий на диске: сегменты .seg с JSON-строками, дописываемые в конец, и файл ack
+    с позицией (сегмент, смещение) первого неподтверждённого события. Подтверждённые сегменты
+    удаляются. Объём неотправленного ограничен max_bytes: при переполнении drop='oldest' удаляет
+    самый старый сегмент, drop='newest' отбрасывает новые события. В памяти событий не держит.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * MiB, segment_bytes: int = 4 * MiB,
+                 drop: str = 'oldest', fsync: bool = False):
+        if drop not in ('oldest', 'newest'):
+            raise ValueError(f'Unknown drop policy {drop}')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(min(segment_bytes, max_bytes // 4), 1)  # должно остаться что удалять
+        self.drop = drop
+        self.fsync = fsync
+        self.metrics = {'appended': 0, 'acked': 0, 'dropped': 0}
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.seg'))
+        self.position = self._load_ack()
+        for seq in [seq for seq in self.segments if seq < self.position[0]]:
+            self._remove(seq)
+        if not self.segments:
+            self.segments = [self.position[0]]
+        if self.position[0] not in self.segments:
+            self.position = (self.segments[0], 0)
+        self._repair(self.segments[-1])
+        self._writer = open(self._segment(self.segments[-1]), 'ab')
+        self.size = sum(os.path.getsize(self._segment(seq)) for seq in self.segments) - self.position[1]
+        self.pending = self._count(*self.position)
+
+    def __len__(self):
+        return self.pending
+
+    def _segment(self, seq: int) -> str:
+        return os.path.join(self.path, f'{seq:012d}.seg')
+
+    def _remove(self, seq: int):
+        try:
+            os.remove(self._segment(seq))
+        except FileNotFoundError:
+            pass
+        self.segments.remove(seq)
+
+    def _load_ack(self) -> (int, int):
+        try:
+            with open(os.path.join(self.path, 'ack')) as f:
+                seq, offset = f.read().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            return (self.segments[0] if self.segments else 0), 0
+
+    def _save_ack(self):
+        tmp = os.path.join(self.path, 'ack.tmp')
+        with open(tmp, 'w') as f:
+            f.write(f'{self.position[0]} {self.position[1]}')
+        os.replace(tmp, os.path.join(self.path, 'ack'))
+
+    def _repair(self, seq: int):
+        """Обрезать недописанную при аварии последнюю строку"""
+        name = self._segment(seq)
+        with open(name, 'ab+') as f:
+            end = f.seek(0, os.SEEK_END)
+            start = max(end - 64 * 1024, 0)
+            while end:
+                f.seek(start)
+                tail = f.read(end - start)
+                if tail.endswith(b'\n'):
+                    return
+                cut = tail.rfind(b'\n')
+                if cut >= 0:
+                    f.truncate(start + cut + 1)
+                    return
+                if not start:
+                    f.truncate(0)
+                    return
+                end, start = start, max(start - 64 * 1024, 0)
+
+    def _count_segment(self, seq: int, offset: int = 0) -> int:
+        count = 0
+        with open(self._segment(seq), 'rb') as f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(MiB), b''):
+                count += chunk.count(b'\n')
+        return count
+
+    def _count(self, seq: int, offset: int) -> int:
+        """Число событий от позиции до конца очереди"""
+        return sum(self._count_segment(s, offset if s == seq else 0) for s in self.segments[self.segments.index(seq):])
+
+    def _roll(self):
+        self._writer.close()
+        seq = self.segments[-1] + 1
+        self.segments.append(seq)
+        self._writer = open(self._segment(seq), 'ab')
+
+    def _drop_oldest(self):
+        if len(self.segments) == 1:
+            self._roll()
+        seq, offset = self.position
+        size = os.path.getsize(self._segment(seq)) - offset
+        dropped = self._count_segment(seq, offset)
+        self._remove(seq)
+        self.position = (self.segments[0], 0)
+        self._save_ack()
+        self.size -= size
+        self.pending -= dropped
+        self.metrics['dropped'] += dropped
+        logging.warning(f'Outbox overflow, {dropped} oldest events dropped')
+
+    def append(self, items):
+        for item in items:
+            line = json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            if len(line) > self.max_bytes:  # не поместится и в пустую очередь - не вытеснять ради него остальные
+                self.metrics['dropped'] += 1
+                logging.error(f'Outbox: event of {len(line)} bytes exceeds max_bytes {self.max_bytes}, dropped')
+                continue
+            while self.size + len(line) > self.max_bytes and self.drop == 'oldest' and self.size:
+                self._drop_oldest()
+            if self.size + len(line) > self.max_bytes:
+                self.metrics['dropped'] += 1
+                continue
+            if self._writer.tell() >= self.segment_bytes:
+                self._roll()
+            self._writer.write(line)
+            self.size += len(line)
+            self.pending += 1
+            self.metrics['appended'] += 1
+        self._writer.flush()
+        if self.fsync:
+            os.fsync(self._writer.fileno())
+
+    def peek(self, max_items: int = 500, max_bytes: int = MiB) -> (list, tuple):
+        """
+        Очередная порция событий с начала очереди, не больше max_items штук и max_bytes байт.
+        :return: (события, позиция для ack)
+        """
+        items = []
+        count = size = 0
+        seq, offset = self.position
+        index = self.segments.index(seq)
+        while True:
+            with open(self._segment(seq), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if count >= max_items or count and size + len(line) > max_bytes:
+                        return items, (seq, offset, count, size)
+                    offset += len(line)
+                    size += len(line)
+                    count += 1
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        logging.error(f'Outbox: broken event in segment {seq} skipped')
+            if index == len(self.segments) - 1:
+                return items, (seq, offset, count, size)
+            index += 1
+            seq, offset = self.segments[index], 0
+
+    def ack(self, position: tuple):
+        """Подтвердить отправку порции, полученной из peek()"""
+        seq, offset, count, size = position
+        if seq not in self.segments:
+            return  # сегмент уже удалён при переполнении
+        for old in [s for s in self.segments if s < seq]:
+            self._remove(old)
+        self.position = (seq, offset)
+        self.size -= size
+        self.pending -= count
+        self.metrics['acked'] += count
+        if not self.pending and offset >= self.segment_bytes:
+            self._roll()  # всё отправлено - освободить место, не дожидаясь заполнения сегмента
+            self._remove(seq)
+            self.position = (self.segments[0], 0)
+        self._save_ack()
+
+    def close(self):
+        self._writer.close()
@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+
+def backoff(delay: float, attempt: int, ceiling: float) -> float:
+    """delay * 2 ** attempt, но не больше ceiling"""
+    if attempt <= 0:
+        return min(delay, ceiling)
+    return min(delay * 2 ** min(attempt, 32), ceiling)
+
+
+class Job(object):
+    def __init__(self, key, func):
+        self.key = key
+        self.func = func  # async func() -> задержка до следующего запуска в секундах или None для остановки
+        self.task = None  # текущий запуск
+        self.due = None  # время следующего запуска; записи кучи с другим due устарели
+
+
+class Scheduler(object):
+    """
+    Единый планировщик проверок: куча (время запуска, ключ) вместо отдельной спящей корутины на устройство.
+    Наступившие задачи выполняет ограниченный пул из workers корутин. Задержки размываются на ±jitter,
+    первый запуск - случайно в пределах spread секунд, чтобы проверки не шли пачками.
+    """
+
+    def __init__(self, workers: int = 500, jitter: float = 0.1, spread: float = 10, retry: float = 10):
+        self.workers = workers
+        self.jitter = jitter
+        self.spread = spread
+        self.retry = retry  # задержка перезапуска задачи, завершившейся исключением
+        self.jobs = {}  # key -> Job
+        self.metrics = {'executed': 0, 'failed': 0, 'lag': 0.0, 'max_lag': 0.0}
+        self._heap = []  # (due, seq, job)
+        self._seq = itertools.count()
+        self._queue = None
+        self._wakeup = None
+        self._tasks = []
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, key):
+        return key in self.jobs
+
+    @property
+    def queued(self) -> int:
+        """Наступившие, но ещё не взятые воркерами проверки"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _push(self, job: Job, delay: float):
+        due = job.due = time.monotonic() + delay
+        if not self._heap or due < self._heap[0][0]:
+            if self._wakeup is not None:
+                self._wakeup.set()
+        heapq.heappush(self._heap, (due, next(self._seq), job))
+
+    def add(self, key, func, delay: float = None):
+        """Добавить или заменить задачу. Текущий запуск заменяемой задачи отменяется."""
+        self.remove(key)
+        job = self.jobs[key] = Job(key, func)
+        self._push(job, random.uniform(0, self.spread) if delay is None else delay)
+
+    def remove(self, key):
+        job = self.jobs.pop(key, None)
+        if job is not None and job.task is not None:
+            job.task.cancel()
+        # запись в куче остаётся и отбрасывается при извлечении
+
+    def reschedule(self, key, delay: float = 0):
+        """Перенести следующий запуск задачи, ожидающей в куче; запущенную или уже наступившую не трогает"""
+        job = self.jobs.get(key)
+        if job is not None and job.due is not None:
+            self._push(job, delay)
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, job = heapq.heappop(self._heap)
+                if self.jobs.get(job.key) is job and job.due == due:
+                    job.due = None  # в очереди воркеров
+                    self._queue.put_nowait((due, job))
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            due, job = await self._queue.get()
+            if self.jobs.get(job.key) is not job:
+                continue
+            lag = time.monotonic() - due
+            self.metrics['lag'] = lag
+            self.metrics['max_lag'] = max(self.metrics['max_lag'], lag)
+            job.task = asyncio.ensure_future(job.func())
+            try:
+                delay = await job.task
+            except asyncio.CancelledError:
+                if job.task.cancelled() and self.jobs.get(job.key) is not job:
+                    continue  # задача удалена во время запуска
+                raise
+            except Exception as e:
+                logging.error(f'Scheduled job {job.key} error {repr(e)}')
+                self.metrics['failed'] += 1
+                delay = self.retry
+            finally:
+                job.task = None
+            self.metrics['executed'] += 1
+            if delay is None:
+                if self.jobs.get(job.key) is job:
+                    self.jobs.pop(job.key)
+            elif self.jobs.get(job.key) is job:
+                self._push(job, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def run(self):
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        try:
+            await self._dispatch()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            for job in self.jobs.values():
+                if job.task is not None:
+                    job.task.cancel()
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import socket
+
+import aiosnmp
+from aiosnmp.message import GetBulkRequest, GetRequest, SnmpMessage, SnmpVarbind, SnmpVersion
+from aiosnmp.protocols import SnmpProtocol
+
+SYS_NAME = '1.3.6.1.2.1.1.5.0'
+
+# Общий транспорт держится на непубличном SnmpProtocol._send(message, addr), проверенном на aiosnmp 0.7.x.
+# На других версиях опрос идёт через публичный aiosnmp.Snmp - по сокету на запрос, но без риска
+# сломаться на обновлении библиотеки.
+SHARED_TRANSPORT = aiosnmp.__version__.startswith('0.7.') and callable(getattr(SnmpProtocol, '_send', None))
+
+
+class SnmpPoller:
+    """
+    SNMP v2c опрос многих контроллеров через один UDP-транспорт.
+    Ответы сопоставляются с запросами по (адрес, порт, request-id) средствами aiosnmp.SnmpProtocol.
+    """
+
+    def __init__(self, community: str = 'UTMC', timeout: float = 1, retries: int = 6):
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self._loop = None
+        self._transport = None
+        self._protocol = None
+        self._addresses = {}  # host -> ip
+
+    async def _connect(self):
+        loop = asyncio.get_event_loop()
+        if self._protocol is not None and self._loop is loop and self._protocol.is_connected:
+            return self._protocol
+        self.close()
+        self._loop = loop
+        self._transport, self._protocol = await loop.create_datagram_endpoint(
+            lambda: SnmpProtocol(self.timeout, self.retries, True),
+            local_addr=('0.0.0.0', 0),
+            family=socket.AF_INET,
+        )
+        return self._protocol
+
+    def close(self):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.close()
+        self._transport = self._protocol = None
+
+    async def _resolve(self, host: str) -> str:
+        ip = self._addresses.get(host)
+        if ip is None:
+            infos = await asyncio.get_event_loop().getaddrinfo(host, None, family=socket.AF_INET)
+            ip = self._addresses[host] = infos[0][4][0]
+        return ip
+
+    async def _request(self, host: str, port, pdu, public) -> dict:
+        """:param public: запрос через публичный API - public(aiosnmp.Snmp), если общий транспорт недоступен"""
+        address = (await self._resolve(host), int(port))
+        if SHARED_TRANSPORT:
+            protocol = await self._connect()
+            varbinds = await protocol._send(SnmpMessage(SnmpVersion.v2c, self.community, pdu), address)
+        else:
+            async with aiosnmp.Snmp(host=address[0], port=address[1], community=self.community,
+                                    timeout=self.timeout, retries=self.retries) as session:
+                varbinds = await public(session)
+        return {v.oid.lstrip('.'): v.value for v in varbinds}
+
+    async def get(self, host: str, port, oids=(SYS_NAME,)) -> dict:
+        """GET нескольких OID одним запросом: {oid: value}"""
+        return await self._request(host, port, GetRequest([SnmpVarbind(oid) for oid in oids]),
+                                   lambda session: session.get(list(oids)))
+
+    async def get_bulk(self, host: str, port, oids, non_repeaters: int = 0, max_repetitions: int = 10) -> dict:
+        return await self._request(host, port, GetBulkRequest([SnmpVarbind(oid) for oid in oids],
+                                                              non_repeaters, max_repetitions),
+                                   lambda session: session.get_bulk(list(oids), non_repeaters=non_repeaters,
+                                                                    max_repetitions=max_repetitions))
+
+    async def poll(self, host: str, port, oids=(SYS_NAME,)):
+        """
+        GET с перехватом ошибок.
+        :return: {oid: value} или None, если агент не ответил
+        """
+        try:
+            return await self.get(host, port, oids)
+        except Exception as e:
+            logging.debug(f'Controller {host}:{port} unawail {repr(e)}')
+            return None
+
+    async def poll_many(self, targets, oids=(SYS_NAME,)) -> dict:
+        """Опрос многих агентов одновременно: {(host, port): {oid: value} | None}"""
+        targets = list(dict.fromkeys((host, str(port)) for host, port in targets))
+        results = await asyncio.gather(*(self.poll(host, port, oids) for host, port in targets))
+        return dict(zip(targets, results))
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import shlex
+import shutil
+import tempfile
+import time
+
+
+class OpenSshTransport:
+    """
+    Команды через системный ssh с мультиплексированием (ControlMaster): первое обращение
+    к user@host поднимает мастер-соединение, последующие идут по нему без рукопожатия.
+    target None - выполнить локально.
+    """
+
+    def __init__(self, persist: float = 300):
+        self.persist = persist  # ssh сам закроет мастер, простоявший столько секунд
+        self._control_dir = None
+
+    def _ssh(self, target: str, timeout: float) -> list:
+        if self._control_dir is None:
+            self._control_dir = tempfile.mkdtemp(prefix='monitoring-ssh-')
+        return [
+            'ssh',
+            '-oStrictHostKeyChecking=no',
+            '-oBatchMode=yes',
+            f'-oConnectTimeout={timeout}',
+            '-oControlMaster=auto',
+            f'-oControlPath={self._control_dir}/%C',
+            f'-oControlPersist={int(self.persist)}',
+            target,
+        ]
+
+    async def run(self, target, command: list, timeout: float = 2) -> (int, str):
+        """:return: (код возврата, stdout)"""
+        if target is not None:
+            command = self._ssh(target, timeout) + ['--', ' '.join(shlex.quote(arg) for arg in command)]
+        pr = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            out, _ = await asyncio.wait_for(pr.communicate(), timeout * 2)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pr.kill()
+            await pr.wait()
+            raise
+        return pr.returncode, out.decode(errors='replace')
+
+    async def close(self, target):
+        """Закрыть мастер-соединение"""
+        if target is None or self._control_dir is None:
+            return
+        pr = await asyncio.create_subprocess_exec(
+            *self._ssh(target, 1), '-O', 'exit',
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await pr.wait()
+
+
+    async def shutdown(self):
+        """Удалить каталог управляющих сокетов; мастер-соединения должны быть уже закрыты"""
+        if self._control_dir is not None:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+
+
+class ServiceMux:
+    """
+    Проверка systemd-сервисов через постоянные ssh-соединения по ключу user@host.
+    Запросы к одному хосту, пришедшие в течение window секунд, объединяются в один
+    `systemctl is-active a b c`. Соединения, простаивающие дольше idle секунд, закрываются.
+    """
+
+    def __init__(self, transport=None, window: float = 0.05, idle: float = 300):
+        self.transport = transport or OpenSshTransport(persist=idle)
+        self.window = window
+        self.idle = idle
+        self.metrics = {'checks': 0, 'batches': 0, 'errors': 0, 'reaped': 0}
+        self._batches = {}  # target -> {service: future}
+        self._last_used = {}  # target -> monotonic
+
+    async def is_active(self, target, service: str, timeout: float = 2) -> bool:
+        """:param target: 'user@host' или None для локальной проверки"""
+        self.metrics['checks'] += 1
+        batch = self._batches.get(target)
+        if batch is None:
+            batch = self._batches[target] = {}
+            asyncio.ensure_future(self._run(target, timeout))
+        future = batch.get(service)
+        if future is None:
+            future = batch[service] = asyncio.get_event_loop().create_future()
+        return await asyncio.shield(future)  # отмена одной проверки не отменяет общий результат
+
+    async def _run(self, target, timeout: float):
+        await asyncio.sleep(self.window)
+        batch = self._batches.pop(target)
+        services = list(batch)
+        self.metrics['batches'] += 1
+        self._last_used[target] = time.monotonic()
+        states = []
+        try:
+            _, out = await self.transport.run(target, ['systemctl', 'is-active', *services], timeout)
+            states = out.split()  # по строке на сервис в порядке аргументов
+        except Exception as e:
+            self.metrics['errors'] += 1
+            logging.debug(f'Service check on {target} error {repr(e)}')
+        for i, service in enumerate(services):
+            if not batch[service].done():
+                batch[service].set_result(i < len(states) and states[i] == 'active')
+        self._last_used[target] = time.monotonic()
+        await self.reap()
+
+    async def reap(self):
+        """Закрыть соединения, простаивающие дольше idle секунд"""
+        now = time.monotonic()
+        for target, used in list(self._last_used.items()):
+            if now - used >= self.idle and target not in self._batches:
+                del self._last_used[target]
+                self.metrics['reaped'] += 1
+                try:
+                    await self.transport.close(target)
+                except Exception as e:
+                    logging.debug(f'SSH close {target} error {repr(e)}')
+
+    async def close(self):
+        for target in list(self._last_used):
+            await self.transport.close(target)
+        self._last_used.clear()
+        await self.transport.shutdown()
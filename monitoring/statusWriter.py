@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+
+
+class StatusWriter(object):
+    """
+    Буфер статусов для redis. monitoring() только кладёт значения, один flusher раз в interval
+    секунд (или при накоплении max_batch полей) пишет их пайплайном HSET mapping на каждый hash
+    в отдельном потоке, не блокируя цикл событий. Повторные записи одного поля схлопываются,
+    побеждает последняя.
+    """
+
+    def __init__(self, redis, interval: float = 1, max_batch: int = 1000):
+        self.redis = redis
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending = {}  # hash -> {field: value}
+        self.depth = 0  # полей в очереди
+        self.metrics = {'queued': 0, 'coalesced': 0, 'written': 0, 'flushes': 0, 'errors': 0,
+                        'last_flush_latency': 0.0, 'max_flush_latency': 0.0}
+        self._wakeup = None
+
+    def set(self, key: str, field, value):
+        fields = self.pending.setdefault(key, {})
+        if field in fields:
+            self.metrics['coalesced'] += 1
+        else:
+            self.depth += 1
+        fields[field] = value
+        self.metrics['queued'] += 1
+        if self.depth >= self.max_batch and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _write(self, batch: dict):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, fields in batch.items():
+            pipe.hset(key, mapping=fields)
+        pipe.execute()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, size = self.pending, self.depth
+        self.pending, self.depth = {}, 0
+        started = time.monotonic()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, batch)
+        except Exception as e:
+            self.metrics['errors'] += 1
+            logging.error(f'Status flush error {repr(e)}')
+            for key, fields in batch.items():  # вернуть в очередь, не затирая более свежие значения
+                newer = self.pending.get(key, {})
+                self.depth += len(fields.keys() - newer.keys())
+                self.pending[key] = {**fields, **newer}
+            return
+        latency = time.monotonic() - started
+        self.metrics['flushes'] += 1
+        self.metrics['written'] += size
+        self.metrics['last_flush_latency'] = latency
+        self.metrics['max_flush_latency'] = max(self.metrics['max_flush_latency'], latency)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
@@ -1,6 +1,22 @@
+import asyncio
+import json
+import aiohttp
 import pytest
+from aiohttp import web
 import checkers
 import errors
+import icmp
+import snmp
+from ssh import ServiceMux
+from governor import Governor
+from inventory import Inventory
+from itemStore import ItemStore
+from notifier import Notifier
+from outbox import Outbox
+from scheduler import Scheduler, backoff
+from statusWriter import StatusWriter
+from topology import Topology, parse_key
+from aiosnmp.message import GetResponse, SnmpMessage, SnmpResponse, SnmpVarbind
 
 TIMEOUT_TIME = 400
 
@@ -78,3 +94,603 @@ async def test_service_checker_eights_wrong_cfg_3():
 async def test_service_checker_no_service():
     assert await checkers.service_checker(
         {'host': 'localhost', 'service_name': 'nosuchservice'}) == (False, errors.NO_SERVICE)
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_pinger_localhost():
+    result = await checkers.pinger.ping('127.0.0.1', 1, count=3)
+    assert result.alive and result.sent == 3 and result.rtt is not None
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_pinger_many_unresolvable():
+    results = await checkers.pinger.ping_many(['127.0.0.1', 'thishostdoesnotexistatall.invalid'], 1, count=2)
+    assert results['127.0.0.1'].alive
+    assert not results['thishostdoesnotexistatall.invalid'].alive
+    assert results['thishostdoesnotexistatall.invalid'].loss == 1.0
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+@pytest.mark.parametrize('strategy', [icmp.FIRST, icmp.PARALLEL])
+async def test_pinger_early_exit(strategy):
+    result = await checkers.pinger.ping('127.0.0.1', 1, count=5, strategy=strategy, stagger=0.5)
+    assert result.alive and result.sent == 1
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_first_success_short_circuit():
+    async def slow():
+        await asyncio.sleep(10)
+        return False
+
+    async def fast(value):
+        return value
+
+    assert await asyncio.wait_for(checkers.first_success(slow(), fast(True)), 1)
+    assert not await checkers.first_success(fast(False), fast(False))
+
+
+class SnmpAgentStub(asyncio.DatagramProtocol):
+    """Локальный SNMP-агент: отвечает на GET значениями из values"""
+
+    def __init__(self, values):
+        self.values = values
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        request = SnmpResponse.decode(data)
+        self.requests += 1
+        response = GetResponse([SnmpVarbind(v.oid, self.values[v.oid.lstrip('.')]) for v in request.data.varbinds])
+        response.request_id = request.data.request_id
+        self.transport.sendto(SnmpMessage(request.version, request.community, response).encode(), addr)
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_snmp_poller_multi_oid():
+    values = {snmp.SYS_NAME: b'controller-1', '1.3.6.1.2.1.1.3.0': 42}
+    transport, agent = await asyncio.get_event_loop().create_datagram_endpoint(
+        lambda: SnmpAgentStub(values), local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+    poller = snmp.SnmpPoller(timeout=0.2, retries=1)
+    try:
+        results = await poller.poll_many([('127.0.0.1', port), ('127.0.0.1', port + 1), ('127.0.0.1', str(port))],
+                                         list(values))
+        assert results[('127.0.0.1', str(port))] == values
+        assert results[('127.0.0.1', str(port + 1))] is None
+        assert agent.requests == 1  # повторы агента в списке опрашиваются один раз
+        assert await poller.poll('127.0.0.1', port, [snmp.SYS_NAME]) == {snmp.SYS_NAME: b'controller-1'}
+    finally:
+        poller.close()
+        transport.close()
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_snmp_poller_public_api_fallback(monkeypatch):
+    monkeypatch.setattr(snmp, 'SHARED_TRANSPORT', False)  # aiosnmp без проверенного SnmpProtocol._send
+    values = {snmp.SYS_NAME: b'controller-1', '1.3.6.1.2.1.1.3.0': 42}
+    transport, agent = await asyncio.get_event_loop().create_datagram_endpoint(
+        lambda: SnmpAgentStub(values), local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+    poller = snmp.SnmpPoller(timeout=0.2, retries=1)
+    try:
+        assert await poller.poll('127.0.0.1', port, list(values)) == values
+        assert await poller.poll('127.0.0.1', port + 1, list(values)) is None
+        assert agent.requests == 1
+    finally:
+        poller.close()
+        transport.close()
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_check_result_is_backward_compatible():
+    result = await checkers.ping_checker({'host': 'localhost'})
+    assert result == (True, '')
+    assert result.ok and result.error == '' and result.latency is not None
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_snmp_checker_components():
+    values = {snmp.SYS_NAME: b'controller-1'}
+    transport, agent = await asyncio.get_event_loop().create_datagram_endpoint(
+        lambda: SnmpAgentStub(values), local_addr=('127.0.0.2', 0))
+    port = transport.get_extra_info('sockname')[1]
+    try:
+        result = await checkers.snmp_checker({'host': '127.0.0.2', 'port': port})
+        assert result == (True, '')
+        assert result.components == {'controller': True, 'spot': False, 'spot_http': False}
+        assert agent.requests == 1
+    finally:
+        transport.close()
+
+
+class RedisPipelineStub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def hset(self, key, mapping):
+        self.commands.append((key, mapping))
+
+    def execute(self):
+        self.redis.executed.append(self.commands)
+
+
+class RedisStub:
+    def __init__(self):
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        return RedisPipelineStub(self)
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_status_writer_coalesces_per_hash():
+    redis = RedisStub()
+    status = StatusWriter(redis, interval=10, max_batch=3)
+    task = asyncio.ensure_future(status.run())
+    await asyncio.sleep(0)
+    status.set('monitoring:controllers', 1, 0)
+    status.set('monitoring:controllers', 1, 1)
+    status.set('monitoring:detectors', 2, 1)
+    assert status.depth == 2 and not redis.executed
+    status.set('monitoring:detectors', 3, 0)
+    await asyncio.sleep(0.1)
+    assert redis.executed == [[('monitoring:controllers', {1: 1}), ('monitoring:detectors', {2: 1, 3: 0})]]
+    assert status.depth == 0 and status.metrics['coalesced'] == 1 and status.metrics['written'] == 3
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_scheduler_add_replace_remove():
+    runs = []
+
+    def job(name, delay):
+        async def step():
+            runs.append(name)
+            return delay
+        return step
+
+    scheduler = Scheduler(workers=2, jitter=0, spread=0)
+    task = asyncio.ensure_future(scheduler.run())
+    scheduler.add('a', job('a', 0.05))
+    scheduler.add('b', job('b', None))  # однократная
+    await asyncio.sleep(0.12)
+    assert runs.count('a') >= 2 and runs.count('b') == 1 and 'b' not in scheduler
+    scheduler.add('a', job('a2', 0.05), delay=0)
+    await asyncio.sleep(0.02)
+    scheduler.remove('a')
+    count = len(runs)
+    await asyncio.sleep(0.1)
+    assert runs[-1] == 'a2' and len(runs) == count and len(scheduler) == 0
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_governor_limits_and_skips():
+    governor = Governor(total=2, limits={'service': 1}, retry=0.5)
+    assert governor.acquire('service') == 0
+    assert governor.acquire('service') == 0.5  # лимит типа - повторить позже
+    assert governor.acquire('http') == 0
+    assert governor.acquire('ping') == 0.5  # общий лимит
+    assert governor.kinds['service']['deferred'] == 1 and governor.kinds['ping']['deferred'] == 1
+    governor.skip('ping')
+    assert governor.metrics == {'running': 2, 'deferred': 2, 'skipped': 1}
+
+    governor.release('service')
+    assert governor.acquire('service') == 0
+    governor.release('service')
+    governor.release('http')
+    assert governor.metrics['running'] == 0
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_governor_saturated_kind_does_not_starve_others():
+    scheduler = Scheduler(workers=10, jitter=0, spread=0)
+    governor = Governor(limits={'service': 2}, retry=0.1)
+    done = {'service': 0, 'ping': 0}
+
+    def job(kind, duration, interval):
+        async def run():
+            retry = governor.acquire(kind)
+            if retry:
+                return retry  # воркер свободен, пока слота нет
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                governor.release(kind)
+            done[kind] += 1
+            return interval
+        return run
+
+    for i in range(20):
+        scheduler.add(('service', i), job('service', 1, 1))
+    for i in range(5):
+        scheduler.add(('ping', i), job('ping', 0.01, 0.5))
+    task = asyncio.ensure_future(scheduler.run())
+    await asyncio.sleep(1.5)
+    assert done['ping'] >= 10  # каждые 0.5 с, несмотря на 18 ждущих service
+    assert governor.kinds['service']['running'] <= 2 and governor.kinds['service']['deferred']
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+class SshTransportStub:
+    def __init__(self, states):
+        self.states = states  # {(target, service): 'active' | 'inactive'}
+        self.calls = []
+        self.closed = []
+
+    async def run(self, target, command, timeout=2):
+        self.calls.append((target, command))
+        await asyncio.sleep(0.01)
+        return 0, ''.join(self.states.get((target, s), 'unknown') + '\n' for s in command[2:])
+
+    async def close(self, target):
+        self.closed.append(target)
+
+    async def shutdown(self):
+        self.closed.append('shutdown')
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_service_mux_batches_per_host():
+    transport = SshTransportStub({('root@a', 'nginx'): 'active', ('root@a', 'redis'): 'failed',
+                                  ('root@b', 'nginx'): 'active'})
+    mux = ServiceMux(transport, window=0.01, idle=10)
+    results = await asyncio.gather(
+        mux.is_active('root@a', 'nginx'),
+        mux.is_active('root@a', 'redis'),
+        mux.is_active('root@a', 'nginx'),
+        mux.is_active('root@a', 'postgres'),
+        mux.is_active('root@b', 'nginx'),
+    )
+    assert results == [True, False, True, False, True]
+    assert sorted(transport.calls) == [('root@a', ['systemctl', 'is-active', 'nginx', 'redis', 'postgres']),
+                                       ('root@b', ['systemctl', 'is-active', 'nginx'])]
+    assert mux.metrics['batches'] == 2 and not transport.closed
+
+    mux.idle = 0
+    await mux.is_active('root@b', 'nginx')
+    assert sorted(transport.closed) == ['root@a', 'root@b']
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_service_mux_close_removes_control_dir():
+    import os
+    from ssh import OpenSshTransport
+    transport = OpenSshTransport()
+    args = transport._ssh('root@a', 1)
+    control = transport._control_dir
+    assert f'-oControlPath={control}/%C' in args
+    assert os.path.isdir(control)
+    await ServiceMux(transport).close()
+    assert not os.path.exists(control) and transport._control_dir is None
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_http_prober_head_first_get_fallback():
+    methods = []
+
+    async def handler(request):
+        methods.append((request.path, request.method))
+        if request.path == '/nohead' and request.method == 'HEAD':
+            return web.Response(status=405)
+        return web.Response(text='x' * 100000)
+
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    prober = checkers.HttpProber(limit_per_host=1)
+    try:
+        probe = await prober.probe(f'http://127.0.0.1:{port}/')
+        assert probe.ok and probe.method == 'HEAD' and probe.connect is not None and probe.ttfb is not None
+        probe = await prober.probe(f'http://127.0.0.1:{port}/')
+        assert probe.ok and probe.connect is None  # соединение из пула
+        assert (await prober.probe(f'http://127.0.0.1:{port}/nohead')).method == 'GET'
+        assert (await prober.probe(f'http://127.0.0.1:{port}/nohead')).ok
+        assert methods == [('/', 'HEAD'), ('/', 'HEAD'), ('/nohead', 'HEAD'), ('/nohead', 'GET'), ('/nohead', 'GET')]
+        assert not (await prober.probe('http://127.0.0.1:1/')).ok
+    finally:
+        await prober.close()
+        await runner.cleanup()
+
+
+def test_inventory_diff():
+    inventory = Inventory()
+
+    def apply(changed, removed):
+        for d in changed:
+            inventory.applied(d)
+        for id_ in removed:
+            inventory.forget(id_)
+
+    devices = [{'id': i, 'ip': f'10.0.0.{i}'} for i in range(5)]
+    changed, removed = inventory.diff(devices)
+    assert [d['id'] for d in changed] == [0, 1, 2, 3, 4] and removed == set()
+    apply(changed, removed)
+
+    devices = [{'id': 4, 'ip': '10.0.0.4'}, {'id': 1, 'ip': '10.0.1.1'}, {'id': 5, 'ip': '10.0.0.5'},
+               {'id': 0, 'ip': '10.0.0.0'}]
+    changed, removed = inventory.diff(devices)
+    assert [d['id'] for d in changed] == [1, 5] and removed == {2, 3}
+    apply(changed, removed)
+
+    changed, removed = inventory.diff([{'id': 0, 'ip': '10.0.1.0'}], full=False)  # updatedSince
+    assert [d['id'] for d in changed] == [0] and removed == set()
+    apply(changed, removed)
+    assert len(inventory) == 4
+
+
+def test_inventory_keeps_changes_that_failed_to_apply():
+    inventory = Inventory()
+    inventory.etag, inventory.since = '"v1"', '2024-01-01T00:00:00+00:00'
+    for d in [{'id': 1, 'ip': '10.0.0.1'}, {'id': 2, 'ip': '10.0.0.2'}]:
+        inventory.applied(d)
+
+    devices = [{'id': 1, 'ip': '10.0.1.1'}, {'id': 3, 'ip': '10.0.0.3'}]
+    changed, removed = inventory.diff(devices)
+    for d in changed:
+        try:
+            if d['id'] == 1:
+                raise ValueError('bad record')
+        except ValueError:
+            inventory.invalidate()
+            continue
+        inventory.applied(d)
+    # удаление 2 не применено - например, упали до него
+    assert inventory.etag is None and inventory.since is None
+
+    changed, removed = inventory.diff(devices)
+    assert [d['id'] for d in changed] == [1] and removed == {2}
+
+
+def test_outbox_rejects_event_larger_than_limit(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=1000, segment_bytes=200)
+    outbox.append([{'event': i} for i in range(50)])
+    queued = len(outbox)
+    outbox.append([{'event': 'x' * 2048}])
+    assert len(outbox) == queued and outbox.metrics['dropped'] == 50 - queued + 1
+    assert outbox.peek(max_items=1000)[0][-1] == {'event': 49}
+
+
+def test_outbox_batches_ack_and_restart(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=1024 * 1024, segment_bytes=100)
+    outbox.append([{'event': i} for i in range(20)])
+    items, position = outbox.peek(max_items=8)
+    assert items == [{'event': i} for i in range(8)] and len(outbox) == 20
+    outbox.ack(position)
+    items, position = outbox.peek(max_items=5)
+    outbox.close()
+
+    outbox = Outbox(str(tmp_path), max_bytes=1024 * 1024, segment_bytes=100)  # перезапуск до ack
+    assert len(outbox) == 12 and outbox.peek(max_items=5)[0] == items
+    items, position = outbox.peek(max_items=100)
+    assert items == [{'event': i} for i in range(8, 20)]
+    outbox.ack(position)
+    assert len(outbox) == 0 and outbox.size == 0 and len(list(tmp_path.glob('*.seg'))) == 1
+
+
+def test_outbox_drops_oldest_on_overflow(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=400, segment_bytes=100)
+    outbox.append([{'event': i} for i in range(100)])  # 13-14 байт на событие
+    assert outbox.size <= 400 and outbox.metrics['dropped'] > 0
+    assert len(outbox) + outbox.metrics['dropped'] == 100
+    items, _ = outbox.peek(max_items=1000)
+    assert items[-1] == {'event': 99} and len(items) == len(outbox)
+
+    outbox = Outbox(str(tmp_path / 'newest'), max_bytes=140, drop='newest')
+    outbox.append([{'event': i} for i in range(20)])
+    assert outbox.peek(max_items=100)[0] == [{'event': i} for i in range(len(outbox))]
+    assert len(outbox) + outbox.metrics['dropped'] == 20
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_item_store_overflow_and_wait():
+    store = ItemStore(maxlen=3)
+    assert not await store.wait(1, timeout=0.01)
+    waiter = asyncio.ensure_future(store.wait(2, timeout=1))
+    store.add(1)
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    store.add(2)
+    assert await waiter
+    store.add(3)
+    store.add(4)
+    assert store.read_all() == (1, 2, 3) and store.metrics == {'added': 3, 'overflow': 1}
+    assert store.get_all() == [1, 2, 3] and len(store) == 0
+
+
+def notification(i, layer='traffic'):
+    return {'name': f'header {i}', 'description': f'message {i}', 'notificationTypeId': -1002, 'layer': layer,
+            'location': None, 'status': 'active'}
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_notifier_groups_and_summarizes():
+    sent = []
+
+    async def send(url, data):
+        sent.append((url, data))
+        return True
+
+    notifier = Notifier(send, '/api/notifications', window=0.05, summary_threshold=3, rate=1000)
+    task = asyncio.ensure_future(notifier.run())
+    for i in range(5):
+        notifier.add(notification(i), label=f'Controller {i}', kind='DOWN')
+    notifier.add(notification(5), label='Controller 5', kind='UP')
+    notifier.add(notification(6, layer='other'), label='Controller 6', kind='DOWN')
+    await asyncio.sleep(0.2)
+    assert len(sent) == 3 and notifier.metrics['sent'] == 7 and notifier.metrics['summaries'] == 1
+    summary = sent[0][1]
+    assert json.loads(summary['description'])['trParams']['devices'] == ', '.join(f'Controller {i}' for i in range(5))
+    assert [data['description'] for _, data in sent[1:]] == ['message 5', 'message 6']
+
+    notifier.bulk_url, notifier.batch = '/api/notifications/bulk', 4
+    for i in range(6):
+        notifier.add(notification(i), kind='DOWN')
+    await asyncio.sleep(0.2)
+    assert [(url, len(data)) for url, data in sent[3:]] == [('/api/notifications/bulk', 4), ('/api/notifications/bulk', 2)]
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_notifier_counts_only_delivered():
+    async def send(url, data):
+        if data['description'] == 'message 1':
+            raise aiohttp.ClientError('connection reset')
+        return data['description'] != 'message 2'
+
+    notifier = Notifier(send, '/api/notifications', window=60, rate=1000)
+    task = asyncio.ensure_future(notifier.run())
+    for i in range(4):
+        notifier.add(notification(i), kind='DOWN')
+    await notifier.flush()  # как при остановке, не дожидаясь окна
+    assert notifier.metrics['sent'] == 2 and notifier.metrics['failed'] == 2 and not len(notifier)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_topology_suppression():
+    topology = Topology()
+    topology.add(('servers', 'switch'), host='10.0.0.1')
+    topology.add(('controllers', 1), [parse_key('servers:switch')], host='10.0.1.1')
+    topology.add(('detectors', 7), host='10.0.1.1', parent_host='10.0.1.1')
+    topology.add(('detectors', 8), host='10.0.2.8', parent_host='10.0.1.1')
+    assert parse_key('controllers:1') == ('controllers', 1)
+    assert topology.blocked_by(('detectors', 7)) is None and topology.suspect(('detectors', 7)) is None
+    assert sorted(topology.descendants(('servers', 'switch')), key=str) == \
+        [('controllers', 1), ('detectors', 7), ('detectors', 8)]
+
+    topology.update(('servers', 'switch'), 1, False)
+    assert topology.suspect(('detectors', 8)) == ('servers', 'switch') and topology.blocked_by(('detectors', 8)) is None
+    topology.update(('servers', 'switch'), 5, True)
+    assert topology.blocked_by(('detectors', 8)) == ('servers', 'switch')
+    assert topology.blocked_by(('servers', 'switch')) is None
+    assert topology.update(('servers', 'switch'), 0, False)  # восстановление
+    assert topology.blocked_by(('detectors', 8)) is None
+
+    topology.remove(('controllers', 1))
+    assert topology.descendants(('servers', 'switch')) == [] and topology.suspect(('detectors', 7)) is None
+
+    topology.add(('controllers', 1), [parse_key('servers:switch')], host='10.0.1.1')  # детекторы снова под ним
+    assert sorted(topology.descendants(('servers', 'switch')), key=str) == \
+        [('controllers', 1), ('detectors', 7), ('detectors', 8)]
+    topology.add(('detectors', 8), host='10.0.2.8')  # перенесён из-под контроллера
+    assert sorted(topology.descendants(('controllers', 1)), key=str) == [('detectors', 7)]
+
+
+class StatusStub:
+    def set(self, key, field, value):
+        pass
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_monitor_sends_deferred_down_after_parent_recovers(monkeypatch):
+    import logging
+    import main
+    topology = Topology()
+    topology.add(('controllers', 1), host='10.0.1.1')
+    topology.add(('detectors', 7), host='10.0.2.7', parent_host='10.0.1.1')
+    sent, results = [], []
+    monkeypatch.setattr(main, 'log', logging.getLogger('test'), raising=False)
+    monkeypatch.setattr(main, 'topology', topology, raising=False)
+    monkeypatch.setattr(main, 'governor', Governor(), raising=False)
+    monkeypatch.setattr(main, 'status', StatusStub(), raising=False)
+    monkeypatch.setattr(main, 'messages', ItemStore(), raising=False)
+    monkeypatch.setattr(main, 'notify', lambda msg, **kwargs: sent.append(kwargs['kind']))
+
+    async def check(config):
+        return results.pop(0)
+
+    monkeypatch.setattr(main, 'check', check)
+    monitor = main.Monitor({'type': 'detectors', 'id': 7, 'name': 'detector', 'checks': ['ping'],
+                            'failed_counter': 2})
+    topology.update(('controllers', 1), 1, False)  # контроллер сбоит, но ещё не DOWN
+    for _ in range(2):
+        results.append(checkers.CheckResult(False, errors.NOT_AVAILABLE))
+        await monitor.step()
+    assert sent == [] and monitor.suppressed
+    assert [e['event'].split(' ')[0] for e in main.messages.read_all()] == ['[DOWN]']  # событие записано
+
+    topology.update(('controllers', 1), 0, False)  # контроллер восстановился, детектор - нет
+    results.append(checkers.CheckResult(False, errors.NOT_AVAILABLE))
+    await monitor.step()
+    assert sent == ['DOWN'] and not monitor.suppressed
+    results.append(checkers.CheckResult(False, errors.NOT_AVAILABLE))
+    await monitor.step()
+    results.append(checkers.CheckResult(True, ''))
+    await monitor.step()
+    assert sent == ['DOWN', 'UP'] and len(main.messages) == 2
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_scheduler_reschedule():
+    runs = []
+
+    async def step():
+        runs.append(1)
+        return 100
+
+    scheduler = Scheduler(workers=1, jitter=0, spread=0)
+    task = asyncio.ensure_future(scheduler.run())
+    scheduler.add('a', step, delay=100)
+    await asyncio.sleep(0.01)
+    scheduler.reschedule('a', 0)
+    await asyncio.sleep(0.05)
+    assert runs == [1]
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_backoff():
+    assert [backoff(10, fails - 5, 600) for fails in range(3, 13)] == [10, 10, 10, 20, 40, 80, 160, 320, 600, 600]
+    assert backoff(10, 1000, 600) == 600
+
+
+@pytest.mark.timeout(TIMEOUT_TIME)
+@pytest.mark.asyncio
+async def test_governor_rate_budget():
+    governor = Governor(rates={'ping': 20})  # запас 20, дальше 20 в секунду
+    for _ in range(20):
+        assert governor.acquire('ping') == 0
+        governor.release('ping')
+    delay = governor.acquire('ping')
+    assert 0 < delay <= 0.05  # следующий токен через 0.05 с, без ожидания внутри acquire
+    assert governor.kinds['ping']['throttled'] == 1 and governor.kinds['ping']['started'] == 20
+    await asyncio.sleep(delay)
+    assert governor.acquire('ping') == 0
+    governor.release('ping')
+    assert governor.acquire('http') == 0  # другой тип без бюджета
+
+    governor = Governor(limits={'ping': 1}, rates={'ping': 10})
+    assert governor.acquire('ping') == 0
+    assert governor.acquire('ping') == 1  # нет слота - токен не тратится
+    assert 8.9 < governor.buckets['ping'].tokens < 9.1
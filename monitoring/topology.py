@@ -0,0 +1,127 @@
+def parse_key(text: str) -> tuple:
+    """'servers:sb' -> ('servers', 'sb'), 'controllers:15' -> ('controllers', 15)"""
+    kind, _, id_ = str(text).partition(':')
+    try:
+        return kind, int(id_)
+    except ValueError:
+        return kind, id_
+
+
+class Topology(object):
+    """
+    Граф зависимостей проверок по ключам планировщика (тип, id). Родители задаются явно
+    (depends_on в конфиге) или через parent_host - адрес устройства, через которое проверяется
+    дочернее (controllerIp у детекторов). Пока предок DOWN, проверки потомков приостанавливаются,
+    пока предок сбоит - их уведомления подавляются.
+    """
+
+    def __init__(self, paused_interval: float = 600):
+        self.paused_interval = paused_interval  # интервал приостановленных проверок, секунды
+        self.parents = {}  # key -> (явные родители, parent_host)
+        self.hosts = {}  # host -> key устройства с этим адресом
+        self.children = {}  # key -> явные потомки
+        self.host_children = {}  # parent_host -> проверяемые через этот адрес
+        self._host = {}  # key -> host
+        self.down = set()  # подтверждённые DOWN (max_fails)
+        self.failing = set()  # есть неудачные проверки
+        self.metrics = {'suppressed_checks': 0, 'suppressed_alerts': 0}
+
+    def add(self, key, parents=(), host: str = None, parent_host: str = None):
+        self.remove(key)
+        self.parents[key] = (tuple(parents), parent_host)
+        for parent in self.parents[key][0]:
+            self.children.setdefault(parent, set()).add(key)
+        if parent_host:
+            self.host_children.setdefault(parent_host, set()).add(key)
+        elif host:
+            self.hosts[host] = key
+            self._host[key] = host
+
+    def remove(self, key):
+        entry = self.parents.pop(key, None)
+        if entry is not None:
+            parents, parent_host = entry
+            for parent in parents:
+                self._discard(self.children, parent, key)
+            if parent_host:
+                self._discard(self.host_children, parent_host, key)
+            host = self._host.pop(key, None)
+            if host is not None and self.hosts.get(host) == key:
+                del self.hosts[host]
+        self.down.discard(key)
+        self.failing.discard(key)
+
+    @staticmethod
+    def _discard(index: dict, name, key):
+        keys = index.get(name)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[name]
+
+    def _parents(self, key):
+        parents, parent_host = self.parents.get(key, ((), None))
+        if parent_host:
+            parent = self.hosts.get(parent_host)
+            if parent is not None and parent != key:
+                return parents + (parent,)
+        return parents
+
+    def _ancestors(self, key):
+        seen = {key}
+        stack = list(self._parents(key))
+        while stack:
+            parent = stack.pop()
+            if parent in seen:
+                continue
+            seen.add(parent)
+            yield parent
+            stack.extend(self._parents(parent))
+
+    def blocked_by(self, key):
+        """Предок в состоянии DOWN или None"""
+        for parent in self._ancestors(key):
+            if parent in self.down:
+                return parent
+        return None
+
+    def suspect(self, key):
+        """Сбоящий или DOWN предок или None - уведомления о потомке стоит подавить"""
+        for parent in self._ancestors(key):
+            if parent in self.failing or parent in self.down:
+                return parent
+        return None
+
+    def _children(self, key):
+        children = set(self.children.get(key, ()))
+        host = self._host.get(key)
+        if host is not None and self.hosts.get(host) == key:
+            children.update(self.host_children.get(host, ()))
+        children.discard(key)
+        return children
+
+    def descendants(self, key) -> list:
+        result, stack, seen = [], list(self._children(key)), {key}
+        while stack:
+            child = stack.pop()
+            if child not in seen:
+                seen.add(child)
+                result.append(child)
+                stack.extend(self._children(child))
+        return result
+
+    def update(self, key, fails: int, down: bool) -> bool:
+        """
+        Состояние проверки после очередного запуска.
+        :return: True, если проверка вышла из DOWN - потомков пора проверить заново
+        """
+        if fails:
+            self.failing.add(key)
+        else:
+            self.failing.discard(key)
+        if down:
+            self.down.add(key)
+            return False
+        restored = key in self.down
+        self.down.discard(key)
+        return restored